@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import base64
+import gzip
+import json
+import os
+import time
+
+from imaging import make_thumbnail
+from storage import content_key, decode_text, encode_text
+
+ARCHIVE_FORMAT = 'medical-history'
+ARCHIVE_VERSION = 1
+ARCHIVE_SUFFIX = '.ndjson.gz'
+# 导入时每个事务写入的记录数
+IMPORT_BATCH = 500
+
+_INSERT_RECORD = '''
+    INSERT INTO history (date_str, title, summary, full_json, created_at, labs_indexed, content_key)
+    SELECT ?, ?, ?, ?, ?, 0, ? WHERE NOT EXISTS (SELECT 1 FROM history WHERE content_key = ?)
+'''
+_INSERT_THUMB = '''
+    INSERT OR IGNORE INTO history_thumbs (record_id, idx, jpeg)
+    SELECT id, ?, ? FROM history WHERE content_key = ?
+'''
+
+
+def export_archive(db, path, include_images=False):
+    """把 history 表逐行写入 gzip 压缩的 NDJSON 归档，内存占用与记录数无关。
+
+    第一行为文件头，其后每行一条记录；data 字段直接写入库中解压后的 JSON 文本，不经过解析和重新序列化。
+    include_images 为 True 时附带缩略图：导入时带来的缩略图，以及任务表中仍能找到原图的报告图片。
+    返回 {'records', 'bytes', 'ms'}。
+    """
+    start = time.perf_counter()
+    job_images, stored_thumbs = {}, set()
+    if include_images:
+        job_images = _job_images(db)
+        stored_thumbs = {r[0] for r in db.query('SELECT DISTINCT record_id FROM history_thumbs')}
+
+    part = path + '.part'
+    count = 0
+    with gzip.open(part, 'wt', encoding='utf-8', compresslevel=6) as f:
+        f.write(json.dumps({'format': ARCHIVE_FORMAT, 'version': ARCHIVE_VERSION,
+                            'exported_at': int(time.time()), 'images': include_images}) + '\n')
+        rows = db.iterate('''
+            SELECT id, date_str, title, summary, created_at, content_key, full_json FROM history ORDER BY id
+        ''')
+        for record_id, date_str, title, summary, created_at, key, full_json in rows:
+            text = decode_text(full_json)
+            if not text:
+                continue
+            meta = {'key': key or content_key(created_at, text), 'date_str': date_str, 'title': title,
+                    'summary': summary, 'created_at': created_at}
+            if record_id in stored_thumbs or record_id in job_images:
+                thumbs = _thumbnails(db, record_id, job_images.get(record_id, ()))
+                if thumbs:
+                    meta['thumbs'] = [base64.b64encode(t).decode('ascii') for t in thumbs]
+            f.write(json.dumps(meta, ensure_ascii=False)[:-1] + ', "data": ' + text + '}\n')
+            count += 1
+    os.replace(part, path)
+    return {'records': count, 'bytes': os.path.getsize(path), 'ms': (time.perf_counter() - start) * 1000}
+
+
+def _job_images(db):
+    # 任务表只保留最近的任务，更早记录的图片已无从查找
+    images = {}
+    for record_id, image_paths in db.query('SELECT record_id, image_paths FROM jobs WHERE record_id IS NOT NULL'):
+        try:
+            images[record_id] = json.loads(image_paths)
+        except ValueError:
+            pass
+    return images
+
+
+def _thumbnails(db, record_id, image_paths):
+    thumbs = [r[0] for r in db.query('SELECT jpeg FROM history_thumbs WHERE record_id = ? ORDER BY idx',
+                                     (record_id,))]
+    if thumbs:
+        return thumbs
+    for path in image_paths:
+        if os.path.exists(path):
+            thumb = make_thumbnail(path)
+            if thumb:
+                thumbs.append(thumb)
+    return thumbs
+
+
+def import_archive(db, path, batch=IMPORT_BATCH):
+    """逐行读取归档，每 batch 条记录用 executemany 在一个事务中写入。
+
+    按内容键去重：已存在的记录（包括同一归档中重复的记录）跳过，因此重复导入同一文件是安全的。
+    导入的记录稍后由后台维护任务提取检验项目。返回 {'records', 'imported', 'duplicates', 'errors', 'ms'}。
+    """
+    start = time.perf_counter()
+    stats = {'records': 0, 'imported': 0, 'duplicates': 0, 'errors': 0}
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            header = json.loads(f.readline() or '{}')
+        except ValueError:
+            header = {}
+        if header.get('format') != ARCHIVE_FORMAT:
+            raise ValueError('not a history archive')
+        if header.get('version', 0) > ARCHIVE_VERSION:
+            raise ValueError(f"unsupported archive version {header.get('version')}")
+
+        records, thumbs, pending = [], [], None
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                text = json.dumps(item['data'], ensure_ascii=False)
+                created_at = item.get('created_at')
+                key = item.get('key') or content_key(created_at, text)
+                records.append((item.get('date_str'), item.get('title'), item.get('summary'),
+                                encode_text(text), created_at, key, key))
+                thumbs.extend((i, base64.b64decode(t), key) for i, t in enumerate(item.get('thumbs') or ()))
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Archive Line Error: {e}")
+                stats['errors'] += 1
+                continue
+            if len(records) >= batch:
+                pending = _write_batch(db, records, thumbs, stats, pending)
+                records, thumbs = [], []
+        pending = _write_batch(db, records, thumbs, stats, pending)
+        _collect(pending, stats)
+    stats['ms'] = (time.perf_counter() - start) * 1000
+    return stats
+
+
+def _write_batch(db, records, thumbs, stats, pending):
+    # 写线程提交本批的同时解析下一批；提交新一批前先等上一批完成，内存中最多保留两批记录
+    _collect(pending, stats)
+    if not records:
+        return None
+
+    def write(conn):
+        inserted = conn.executemany(_INSERT_RECORD, records).rowcount
+        if thumbs:
+            conn.executemany(_INSERT_THUMB, thumbs)
+        return len(records), inserted
+
+    return db.submit(write)
+
+
+def _collect(pending, stats):
+    if pending is None:
+        return
+    count, inserted = pending.result()
+    stats['records'] += count
+    stats['imported'] += inserted
+    stats['duplicates'] += count - inserted
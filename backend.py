@@ -1,20 +1,13 @@
 # -*- coding: utf-8 -*-
 import os
-import json
 import time
-import shutil
-import base64
-import hmac
-import hashlib
-import uuid
 import threading
-import requests
-import urllib.parse
-import sqlite3
-from datetime import datetime
 from kivy.utils import platform
 from kivy.clock import Clock
 
+from core import AnalysisCore
+from speech import SpeechService
+
 if platform == 'android':
     from jnius import autoclass, cast
     from android import activity
@@ -27,7 +20,8 @@ else:
     activity = None
 
 
-class BackendService:
+class BackendService(AnalysisCore):
+    """应用内的 AnalysisCore 单例，增加 Android 相机、相册、TTS 和 toast。"""
     _instance = None
 
     def __new__(cls):
@@ -36,24 +30,27 @@ class BackendService:
             cls._instance._init()
         return cls._instance
 
+    def __init__(self):
+        # 单例已在 __new__ 中初始化，再次调用 BackendService() 不重置状态
+        pass
+
     def _init(self):
         self.callback = None
         self.temp_image_path = None
         self.tts = None
+        self.speech = SpeechService(None, None)
+        super()._init()
         self.setup_android()
-        self.setup_db()
+
+    def _setup_services(self):
+        super()._setup_services()
+        self.setup_tts()
 
     def setup_android(self):
         if platform == 'android':
             try:
                 activity.bind(on_activity_result=self.on_activity_result)
 
-                # TTS Init
-                TTS = autoclass('android.speech.tts.TextToSpeech')
-                PythonActivity = autoclass('org.kivy.android.PythonActivity')
-                context = PythonActivity.mActivity.getApplicationContext()
-                self.tts = TTS(context, None)
-
                 # StrictMode Bypass
                 StrictMode = autoclass('android.os.StrictMode')
                 Builder = autoclass('android.os.StrictMode$VmPolicy$Builder')
@@ -61,6 +58,17 @@ class BackendService:
             except Exception as e:
                 print(f"Android Init Error: {e}")
 
+    def setup_tts(self):
+        if platform == 'android':
+            try:
+                TTS = autoclass('android.speech.tts.TextToSpeech')
+                PythonActivity = autoclass('org.kivy.android.PythonActivity')
+                context = PythonActivity.mActivity.getApplicationContext()
+                self.tts = TTS(context, None)
+                self.speech = SpeechService(self.tts, os.path.join(self.get_cache_dir(), 'tts'))
+            except Exception as e:
+                print(f"TTS Init Error: {e}")
+
     def get_files_dir(self):
         if platform == 'android':
             try:
@@ -79,44 +87,6 @@ class BackendService:
                 return "."
         return "."
 
-    # --- Database ---
-    def setup_db(self):
-        db_path = os.path.join(self.get_files_dir(), 'medical_history.db')
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date_str TEXT,
-                title TEXT,
-                summary TEXT,
-                full_json TEXT
-            )
-        ''')
-        self.conn.commit()
-
-    def save_record(self, result_data):
-        try:
-            date = datetime.now().strftime("%Y-%m-%d %H:%M")
-            title = result_data.get('title', '未命名报告')
-            summary = result_data.get('core_conclusion', '')
-            json_str = json.dumps(result_data, ensure_ascii=False)
-
-            self.cursor.execute(
-                'INSERT INTO history (date_str, title, summary, full_json) VALUES (?, ?, ?, ?)',
-                (date, title, summary, json_str)
-            )
-            self.conn.commit()
-        except Exception as e:
-            print(f"DB Save Error: {e}")
-
-    def get_history(self):
-        try:
-            self.cursor.execute('SELECT id, date_str, title, summary, full_json FROM history ORDER BY id DESC')
-            return self.cursor.fetchall()
-        except:
-            return []
-
     # --- Android Features ---
     def toast(self, text):
         if platform == 'android':
@@ -131,11 +101,17 @@ class BackendService:
             print(f"[TOAST] {text}")
 
     def speak(self, text):
-        if self.tts:
-            try:
-                self.tts.speak(str(text), 0, None)
-            except:
-                pass
+        try:
+            self.speech.speak(text)
+        except Exception as e:
+            print(f"TTS Error: {e}")
+
+    def prepare_speech(self, text):
+        # 后台预先合成朗读音频，点击朗读时直接播放
+        try:
+            self.speech.prepare(text)
+        except Exception as e:
+            print(f"TTS Prepare Error: {e}")
 
     def open_camera(self, callback):
         self.callback = callback
@@ -170,6 +146,7 @@ class BackendService:
                 PythonActivity = autoclass('org.kivy.android.PythonActivity')
                 intent = Intent(Intent.ACTION_PICK)
                 intent.setType("image/*")
+                intent.putExtra(Intent.EXTRA_ALLOW_MULTIPLE, True)
                 PythonActivity.mActivity.startActivityForResult(intent, 0x102)
             except:
                 self.toast("相册启动失败")
@@ -179,103 +156,56 @@ class BackendService:
 
         if request_code == 0x101:  # Camera
             if self.temp_image_path and os.path.exists(self.temp_image_path):
-                if self.callback:
-                    Clock.schedule_once(lambda dt: self.callback(self.temp_image_path), 0)
+                threading.Thread(target=self._ingest_capture, args=(self.temp_image_path,)).start()
             else:
                 self.toast("拍照取消")
 
         elif request_code == 0x102:  # Gallery
             if intent:
-                uri = intent.getData()
-                threading.Thread(target=self._copy_uri_content, args=(uri,)).start()
+                # 多选时图片在 ClipData 中，单选时在 getData()
+                uris = []
+                clip = intent.getClipData()
+                if clip:
+                    for i in range(clip.getItemCount()):
+                        uris.append(clip.getItemAt(i).getUri())
+                elif intent.getData():
+                    uris.append(intent.getData())
+                if uris:
+                    threading.Thread(target=self._copy_uri_content, args=(uris,)).start()
         return True
 
-    def _copy_uri_content(self, uri):
+    def _ingest_capture(self, path):
+        try:
+            self._deliver(self.images.ingest_file(path))
+        except Exception as e:
+            print(f"Camera Ingest Error: {e}")
+            # 导入失败时仍使用相机写入的原图
+            self._deliver(path)
+
+    def _copy_uri_content(self, uris):
         try:
             PythonActivity = autoclass('org.kivy.android.PythonActivity')
             content_resolver = PythonActivity.mActivity.getContentResolver()
-            pfd = content_resolver.openFileDescriptor(uri, "r")
-            fd = pfd.getFd()
-
-            dest_path = os.path.join(self.get_cache_dir(), f"gallery_{int(time.time())}.jpg")
-            with os.fdopen(fd, 'rb', closefd=False) as src:
-                with open(dest_path, 'wb') as dst:
-                    shutil.copyfileobj(src, dst)
-            pfd.close()
-
-            if self.callback:
-                Clock.schedule_once(lambda dt: self.callback(dest_path), 0)
+            paths = []
+            for uri in uris:
+                # 读取一遍即完成哈希、去重和缩小保存
+                pfd = content_resolver.openFileDescriptor(uri, "r")
+                try:
+                    with os.fdopen(pfd.getFd(), 'rb', closefd=False) as src:
+                        paths.append(self.images.ingest(src))
+                finally:
+                    pfd.close()
+            self._deliver(paths)
         except Exception as e:
             print(f"Gallery Error: {e}")
             self.toast("图片读取失败")
 
-    # --- AI & OCR ---
-    def analyze_report(self, image_path, keys):
-        ty_key = keys.get('tongyi_key')
-        ds_key = keys.get('deepseek_key')
-        ak = keys.get('ali_ak')
-        sk = keys.get('ali_sk')
-
-        if not ty_key and not ak:
-            return {"title": "配置错误", "core_conclusion": "未检测到API密钥",
-                    "abnormal_analysis": "请在设置中输入通义千问Key或阿里云Key"}
-
-        # 方案 A: 通义千问 VL
-        if ty_key:
-            res = self._call_tongyi_vl(image_path, ty_key)
-            if res: return self._format_ai_result(res, ds_key)
-
-        # 方案 B: 阿里云OCR
-        if ak and sk and ds_key:
-            ocr_text = self._call_aliyun_ocr(image_path, ak, sk)
-            if ocr_text:
-                return self._format_ai_result(ocr_text, ds_key)
-
-        return {"title": "分析失败", "core_conclusion": "无法识别图片内容", "life_advice": "请尝试重拍，保证文字清晰"}
-
-    def _call_tongyi_vl(self, path, key):
+    def _deliver(self, paths):
+        # 刚导入的图片和任务队列中的图片不参与淘汰
+        keep = [paths] if isinstance(paths, str) else list(paths)
         try:
-            with open(path, 'rb') as f:
-                b64 = base64.b64encode(f.read()).decode('utf-8')
-            url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
-            data = {
-                "model": "qwen-vl-max",
-                "input": {"messages": [{"role": "user", "content": [
-                    {"image": f"data:image/jpeg;base64,{b64}"},
-                    {"text": "提取这张医疗报告的所有文字信息"}
-                ]}]}
-            }
-            resp = requests.post(url, json=data, headers={"Authorization": f"Bearer {key}"}, timeout=35)
-            if resp.status_code == 200:
-                return resp.json()['output']['choices'][0]['message']['content'][0]['text']
-        except:
-            pass
-        return None
-
-    def _call_aliyun_ocr(self, path, ak, sk):
-        # 简化版，推荐使用 VL
-        return None
-
-    def _format_ai_result(self, text, ds_key):
-        if not ds_key:
-            return {"title": "识别结果", "core_conclusion": text[:100], "abnormal_analysis": text}
-
-        prompt = f"""
-        你是一位医生。根据内容生成JSON。
-        内容：{text[:3000]}
-        格式：{{"title":"标题","core_conclusion":"结论","abnormal_analysis":"异常","life_advice":"建议"}}
-        纯JSON，无Markdown。
-        """
-        try:
-            resp = requests.post(
-                "https://api.deepseek.com/v1/chat/completions",
-                headers={"Authorization": f"Bearer {ds_key}"},
-                json={"model": "deepseek-chat", "messages": [{"role": "user", "content": prompt}],
-                      "response_format": {"type": "json_object"}},
-                timeout=20
-            )
-            content = resp.json()['choices'][0]['message']['content']
-            content = content.replace("```json", "").replace("```", "").strip()
-            return json.loads(content)
-        except:
-            return {"title": "解析完成", "core_conclusion": "AI整理失败，显示原文", "abnormal_analysis": text}
\ No newline at end of file
+            self.images.evict(keep + self.jobs.active_paths())
+        except Exception as e:
+            print(f"Image Cache Error: {e}")
+        if self.callback:
+            Clock.schedule_once(lambda dt: self.callback(paths), 0)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""批量分析：用进程池分析目录中的报告图片，每份结果追加写入 JSONL，中断后重新运行会跳过已完成的图片。
+
+不需要 Kivy。示例：
+    python batch.py reports/ --workers 4 --out results.jsonl
+密钥从命令行或环境变量 TONGYI_KEY、DEEPSEEK_KEY、ALI_AK、ALI_SK 读取。每个进程持有一个 AnalysisCore，
+共用 --data-dir（默认 ./batch_data）下的历史数据库和识别缓存；成功的结果同时保存到历史记录，
+--no-save 时只写结果文件。批处理进程不执行应用的定期维护，不会按保留策略删除历史记录或清理图片。
+"""
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from metrics import percentile
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+# 单个进程内分析是串行的，大部分时间在等待网络，进程数可以多于 CPU 核数
+DEFAULT_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+# 已处理完、重新运行时跳过的状态；failed、timeout、error 会重试
+FINAL_STATES = ('done', 'rejected')
+KEY_ENV = {'tongyi_key': 'TONGYI_KEY', 'deepseek_key': 'DEEPSEEK_KEY', 'ali_ak': 'ALI_AK', 'ali_sk': 'ALI_SK'}
+# 单独的数据目录，避免写入当前目录或与应用共用的历史库
+DEFAULT_DATA_DIR = 'batch_data'
+
+# 工作进程内的状态，由 _init_worker 设置
+_core = None
+_keys = None
+_save = True
+
+
+def find_images(paths, recursive=False):
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            pattern = os.path.join(path, '**', '*') if recursive else os.path.join(path, '*')
+            images.extend(sorted(p for p in glob.glob(pattern, recursive=recursive)
+                                 if p.lower().endswith(IMAGE_EXTS) and os.path.isfile(p)))
+        elif os.path.isfile(path):
+            images.append(path)
+    return images
+
+
+def file_id(path):
+    # 同一路径的文件被替换后大小或修改时间会变化，需要重新分析
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_size}|{int(st.st_mtime)}"
+
+
+def load_finished(out_path):
+    finished = set()
+    if not os.path.exists(out_path):
+        return finished
+    with open(out_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # 上次运行被强行终止时最后一行可能不完整
+                continue
+            if row.get('status') in FINAL_STATES:
+                finished.add(row.get('id'))
+    return finished
+
+
+def _init_worker(data_dir, keys, deadline, save, endpoints):
+    global _core, _keys, _save
+    # 中断由主进程处理，工作进程忽略 Ctrl+C，避免每个进程各打印一遍堆栈
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from core import AnalysisCore
+    from providers import ProviderClient
+
+    _core = AnalysisCore(data_dir, data_dir)
+    _core.deadline = deadline
+    # 应用的维护会按保留策略删减历史库、删除缓存目录中的图片，批处理中不执行
+    _core.auto_maintenance = False
+    _core.ensure_ready()
+    for name, base_url in endpoints.items():
+        _core.clients[name] = ProviderClient(base_url)
+    _keys, _save = keys, save
+
+
+def _analyze(path):
+    from providers import AnalysisHandle, DeadlineExceeded
+
+    start = time.perf_counter()
+    record_id = None
+    try:
+        status, result = _run_pipeline(path, AnalysisHandle(_core.deadline))
+    except DeadlineExceeded:
+        status, result = 'timeout', _core.timeout_result()
+    except Exception as e:
+        print(f"Batch Error: {path}: {e}", file=sys.stderr)
+        status, result = 'error', {'error': str(e)}
+    ms = (time.perf_counter() - start) * 1000
+    if status == 'done' and _save:
+        try:
+            saved = _core.save_record(result)
+            record_id = saved.result() if saved else None
+        except Exception as e:
+            # 保存失败时本份按 error 记录，重新运行时会再次分析
+            print(f"Batch Save Error: {path}: {e}", file=sys.stderr)
+            status, result = 'error', dict(result, error=str(e))
+    return {'status': status, 'ms': round(ms, 1), 'record_id': record_id, 'result': result}
+
+
+def _run_pipeline(path, handle):
+    # 与任务队列相同的三个阶段，分别判断结果状态
+    rejected = _core.precheck([path], _keys)
+    if rejected:
+        return 'rejected', rejected
+    text = _core.extract_pages([path], _keys, handle=handle)
+    if not text:
+        return 'failed', _core.failed_result()
+    result = _core.format_text(text, _keys, handle=handle)
+    return ('failed' if _core.format_failed(result) else 'done'), result
+
+
+def summarize(rows, skipped, wall, workers):
+    latencies = [r['ms'] for r in rows]
+    return {
+        'processed': len(rows),
+        'skipped': skipped,
+        'status': dict(Counter(r['status'] for r in rows)),
+        'workers': workers,
+        'wall_s': round(wall, 2),
+        'reports_per_min': round(len(rows) / wall * 60, 2) if wall > 0 else None,
+        'latency_ms': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                       'max': max(latencies)} if latencies else None,
+    }
+
+
+def run(args, keys):
+    images = find_images(args.inputs, args.recursive)
+    finished = set() if args.restart else load_finished(args.out)
+    todo = [(p, file_id(p)) for p in images]
+    todo = [(p, i) for p, i in todo if i not in finished]
+    skipped = len(images) - len(todo)
+    print(f"[BATCH] {len(images)} images, {skipped} already done, {len(todo)} to analyze", file=sys.stderr)
+
+    data_dir = os.path.abspath(args.data_dir)
+    os.makedirs(data_dir, exist_ok=True)
+    # 主进程先打开一次数据库完成迁移，工作进程启动时不会同时执行迁移
+    from storage import Database
+    Database(os.path.join(data_dir, 'medical_history.db')).close()
+
+    endpoints = {name: url for name, url in (('dashscope', args.dashscope_url),
+                                             ('deepseek', args.deepseek_url)) if url}
+    interval = 60.0 / args.rate if args.rate else 0
+    rows = []
+    wall_start = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                               initargs=(data_dir, keys, args.deadline, not args.no_save, endpoints))
+    try:
+        with open(args.out, 'a', encoding='utf-8') as out:
+            pending, queue, next_submit = {}, iter(todo), 0.0
+            while True:
+                # 在途任务不超过进程数的两倍，目录很大时不会一次提交全部图片
+                while len(pending) < args.workers * 2:
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    if interval:
+                        # --rate 限制所有进程合计的请求速率
+                        time.sleep(max(0.0, next_submit - time.monotonic()))
+                        next_submit = time.monotonic() + interval
+                    pending[pool.submit(_analyze, item[0])] = item
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    path, fid = pending.pop(fut)
+                    try:
+                        row = dict(fut.result(), id=fid, path=path)
+                    except Exception as e:
+                        # 工作进程异常退出等，只影响这一份
+                        row = {'status': 'error', 'ms': 0, 'record_id': None, 'result': {'error': str(e)},
+                               'id': fid, 'path': path}
+                    out.write(json.dumps(row, ensure_ascii=False) + '\n')
+                    out.flush()
+                    rows.append(row)
+                    print(f"[{len(rows) + skipped}/{len(images)}] {row['status']} {row['ms']:.0f}ms {path}",
+                          file=sys.stderr)
+    except KeyboardInterrupt:
+        print("[BATCH] interrupted, finished results are kept; rerun to resume", file=sys.stderr)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return summarize(rows, skipped, time.perf_counter() - wall_start, args.workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help='图片文件或目录')
+    parser.add_argument('--recursive', action='store_true', help='包含子目录中的图片')
+    parser.add_argument('--out', default='results.jsonl', help='逐份追加写入的结果文件，也用于断点续跑')
+    parser.add_argument('--restart', action='store_true', help='忽略结果文件中已完成的记录，全部重新分析')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='历史数据库和缓存所在目录')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='进程数')
+    parser.add_argument('--rate', type=float, default=0, help='每分钟最多发起的分析数，0 为不限制')
+    parser.add_argument('--deadline', type=float, default=None, help='单份报告的时间预算（秒）')
+    parser.add_argument('--no-save', action='store_true', help='不写入历史记录')
+    parser.add_argument('--dashscope-url', help='替换通义千问接口地址，如代理或本地替身服务')
+    parser.add_argument('--deepseek-url', help='替换 DeepSeek 接口地址')
+    for name, env in KEY_ENV.items():
+        parser.add_argument('--' + name.replace('_', '-'), default=os.environ.get(env, ''), help=f'默认读取 ${env}')
+    args = parser.parse_args()
+
+    keys = {name: getattr(args, name) for name in KEY_ENV}
+    if not keys['tongyi_key'] and not keys['ali_ak']:
+        parser.error('需要通义千问 Key 或阿里云 AccessKey')
+    if args.deadline is None:
+        from providers import DEFAULT_DEADLINE
+        args.deadline = DEFAULT_DEADLINE
+    args.workers = max(1, args.workers)
+
+    print(json.dumps(run(args, keys), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""历史归档基准：生成模拟历史记录，测量导出、导入和重复导入（全部去重）的耗时与内存峰值。
+
+不需要 Kivy。示例：
+    python bench/archive_bench.py --records 20000
+tracemalloc 会明显拖慢执行，加 --memory 时才统计内存峰值，此时耗时不具参考价值。
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from archive import export_archive, import_archive  # noqa: E402
+from mock_server import SAMPLE_RESULT  # noqa: E402
+from storage import Database, content_key, encode_payload  # noqa: E402
+
+BASE_TIME = 1700000000
+
+
+def seed(db, count, batch=1000):
+    for first in range(0, count, batch):
+        rows = []
+        for n in range(first, min(count, first + batch)):
+            data = dict(SAMPLE_RESULT, title=f"{SAMPLE_RESULT['title']} #{n}")
+            created_at = BASE_TIME + n * 3600
+            payload = encode_payload(data)
+            rows.append((time.strftime('%Y-%m-%d %H:%M', time.localtime(created_at)), data['title'],
+                         data['core_conclusion'], payload, created_at,
+                         content_key(created_at, json.dumps(data, ensure_ascii=False))))
+        db.executemany('INSERT INTO history (date_str, title, summary, full_json, created_at, labs_indexed, '
+                       'content_key) VALUES (?, ?, ?, ?, ?, 1, ?)', rows).result()
+
+
+def measure(trace, fn, *args):
+    if not trace:
+        result = fn(*args)
+        return dict(result, ms=round(result['ms'], 1))
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return dict(result, peak_kb=peak // 1024, ms=round(result['ms'], 1))
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='archivebench-')
+    try:
+        source = Database(os.path.join(workdir, 'source.db'))
+        seed(source, args.records)
+        path = os.path.join(workdir, 'history.ndjson.gz')
+        exported = measure(args.memory, export_archive, source, path)
+        source.close()
+
+        target = Database(os.path.join(workdir, 'target.db'))
+        imported = measure(args.memory, import_archive, target, path)
+        reimported = measure(args.memory, import_archive, target, path)
+        target.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'records': args.records, 'export': exported, 'import': imported, 'reimport': reimported,
+            'records_per_s': {'export': round(args.records / max(exported['ms'], 1) * 1000),
+                              'import': round(args.records / max(imported['ms'], 1) * 1000)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--memory', action='store_true', help='用 tracemalloc 统计内存峰值')
+    parser.add_argument('--out', help='结果写入文件，默认输出到标准输出')
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""上传请求体内存基准：对比整体拼接与分块流式编码两种方式发送图片时的 Python 堆内存峰值。
+
+不需要 Kivy。示例：
+    python bench/mem_bench.py --sizes 1 4 16 32
+对每个大小（MB）生成随机内容的图片文件，经 ProviderClient 发送到本地替身服务，
+用 tracemalloc 统计发送过程中的内存峰值。流式方式的峰值应与图片大小无关。
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_server import MockConfig, MockServer  # noqa: E402
+from providers import DATA_URL, VL_PATH, ProviderClient, json_body  # noqa: E402
+
+MB = 1024 * 1024
+HEADERS = {"Content-Type": "application/json"}
+
+
+def request_data(image):
+    return {"model": "qwen-vl-max", "input": {"messages": [{"role": "user", "content": [
+        {"image": image}, {"text": "提取这张医疗报告的所有文字信息"}]}]}}
+
+
+def send_buffered(client, path):
+    # 改动前的做法：原图、base64 字符串、data URL 与 JSON 请求体同时驻留内存
+    with open(path, 'rb') as f:
+        payload = f.read()
+    b64 = base64.b64encode(payload).decode('utf-8')
+    raw = json.dumps(request_data(f"data:image/jpeg;base64,{b64}"), ensure_ascii=False).encode('utf-8')
+    client.post(VL_PATH, data=raw, headers=HEADERS, timeout=60).close()
+
+
+def send_streamed(client, path):
+    with open(path, 'rb') as f:
+        body = json_body(request_data(DATA_URL), f, os.path.getsize(path))
+        client.post(VL_PATH, data=body, headers=HEADERS, timeout=60).close()
+
+
+METHODS = (('buffered', send_buffered), ('streamed', send_streamed))
+
+
+def peak_kb(fn, client, path):
+    tracemalloc.start()
+    try:
+        fn(client, path)
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def write_image(path, size_mb):
+    with open(path, 'wb') as f:
+        remaining = int(size_mb * MB)
+        while remaining > 0:
+            f.write(os.urandom(min(MB, remaining)))
+            remaining -= MB
+
+
+def run(args):
+    # 替身服务与基准在同一进程内，tracemalloc 也会统计它的分配，因此只计数不保存请求体
+    server = MockServer(MockConfig(discard_body=True)).start()
+    client = ProviderClient(server.base_url)
+    workdir = tempfile.mkdtemp(prefix='membench-')
+    rows = []
+    try:
+        for size_mb in args.sizes:
+            path = os.path.join(workdir, f"image_{size_mb}mb.jpg")
+            write_image(path, size_mb)
+            # 先发送一次，连接建立与模块导入不计入峰值
+            send_streamed(client, path)
+            row = {'image_mb': size_mb}
+            for name, fn in METHODS:
+                row[f'{name}_peak_kb'] = min(peak_kb(fn, client, path) for _ in range(args.repeat))
+            rows.append(row)
+            os.remove(path)
+    finally:
+        client.close()
+        server.stop()
+        os.rmdir(workdir)
+
+    streamed = [r['streamed_peak_kb'] for r in rows]
+    return {'rows': rows, 'streamed_spread_kb': max(streamed) - min(streamed) if streamed else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 16, 32], help='图片大小（MB）')
+    parser.add_argument('--repeat', type=int, default=2, help='每项重复次数，取最小峰值')
+    parser.add_argument('--out', help='结果写入文件，默认输出到标准输出')
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""DashScope 多模态接口与 DeepSeek 对话接口的本地替身，供离线基准测试使用。
+
+可配置首字节延迟、带宽、错误率和流式输出；record 模式把请求转发到真实服务并保存响应，
+replay 模式按请求内容回放保存的响应，未命中时退回内置的示例响应。
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from providers import CHAT_PATH, DASHSCOPE_BASE, DEEPSEEK_BASE, VL_PATH  # noqa: E402
+
+SAMPLE_OCR_TEXT = """某某市第一人民医院 检验报告单
+姓名：张三 性别：男 年龄：45岁 科室：内科
+项目名称 结果 单位 参考范围
+谷丙转氨酶(ALT) 68 U/L 9-50 ↑
+谷草转氨酶(AST) 35 U/L 15-40
+葡萄糖(GLU) 6.8 mmol/L 3.9-6.1 ↑
+总胆固醇(TC) 5.9 mmol/L 2.8-5.2 ↑
+甘油三酯(TG) 1.6 mmol/L 0.56-1.7
+白细胞计数(WBC) 6.2 10^9/L 3.5-9.5
+血红蛋白(HGB) 142 g/L 130-175
+肌酐(CREA) 88 umol/L 57-111
+检验者：李四 审核者：王五
+本报告仅对所检标本负责"""
+
+SAMPLE_RESULT = {
+    "title": "血生化检验报告",
+    "core_conclusion": "转氨酶、血糖和总胆固醇轻度升高，其余指标正常",
+    "abnormal_analysis": "ALT 68 U/L 高于参考范围，提示肝细胞轻度损伤；空腹血糖 6.8 mmol/L 偏高；总胆固醇 5.9 mmol/L 偏高。",
+    "life_advice": "清淡饮食，减少油脂和酒精摄入，规律运动，1-3 个月后复查肝功能、血糖和血脂。",
+    "lab_items": [
+        {"name": "谷丙转氨酶(ALT)", "value": "68", "unit": "U/L", "range": "9-50", "flag": "↑"},
+        {"name": "葡萄糖(GLU)", "value": "6.8", "unit": "mmol/L", "range": "3.9-6.1", "flag": "↑"},
+        {"name": "总胆固醇(TC)", "value": "5.9", "unit": "mmol/L", "range": "2.8-5.2", "flag": "↑"},
+    ],
+}
+
+UPSTREAMS = {VL_PATH: DASHSCOPE_BASE, CHAT_PATH: DEEPSEEK_BASE}
+IO_CHUNK = 4096
+
+
+def _pieces(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)] or ['']
+
+
+def vl_response(text, stream):
+    if not stream:
+        return json.dumps({"output": {"choices": [{"message": {"content": [{"text": text}]}}]}},
+                          ensure_ascii=False).encode('utf-8')
+    events = [{"output": {"choices": [{"message": {"content": [{"text": piece}]}}]}} for piece in _pieces(text, 16)]
+    return b''.join(f"data:{json.dumps(e, ensure_ascii=False)}\n\n".encode('utf-8') for e in events)
+
+
+def chat_response(content, stream):
+    if not stream:
+        return json.dumps({"choices": [{"message": {"role": "assistant", "content": content}}]},
+                          ensure_ascii=False).encode('utf-8')
+    events = [{"choices": [{"delta": {"content": piece}}]} for piece in _pieces(content, 8)]
+    body = b''.join(f"data: {json.dumps(e, ensure_ascii=False)}\n\n".encode('utf-8') for e in events)
+    return body + b"data: [DONE]\n\n"
+
+
+class MockConfig:
+    """单个替身服务的行为参数。"""
+
+    def __init__(self, latency=0.0, bandwidth=0, error_rate=0.0, event_interval=0.0,
+                 mode='mock', record_dir=None, seed=None, discard_body=False):
+        self.latency = latency  # 首字节延迟（秒）
+        self.bandwidth = bandwidth  # 上下行带宽（字节/秒），0 为不限
+        self.error_rate = error_rate  # 返回 503 的概率
+        self.event_interval = event_interval  # 流式输出相邻事件的间隔（秒）
+        self.mode = mode  # mock / record / replay
+        self.record_dir = record_dir
+        self.discard_body = discard_body  # 只计数不保存请求体，内存基准中避免替身服务占用内存
+        self.random = random.Random(seed)
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.replay_misses = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self.lock:
+            return {'requests': self.requests, 'errors': self.errors, 'bytes_in': self.bytes_in,
+                    'bytes_out': self.bytes_out, 'replay_misses': self.replay_misses}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        # 供 ProviderClient.warm_up 预连接
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        body = self._read_body()
+        self.server.stats.add(requests=1, bytes_in=len(body))
+        if self.config.error_rate and self.config.random.random() < self.config.error_rate:
+            self.server.stats.add(errors=1)
+            self._send(503, 'application/json', b'{"error":"injected"}', False)
+            return
+
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError:
+            request = {}
+        stream = bool(request.get('stream')) or self.headers.get('X-DashScope-SSE') == 'enable'
+        if self.config.latency:
+            time.sleep(self.config.latency)
+
+        if self.config.mode == 'record':
+            status, content_type, payload = self._forward(body)
+            self._save(body, status, content_type, payload)
+        else:
+            recorded = self._load(body) if self.config.mode == 'replay' else None
+            if recorded:
+                status, content_type, payload = recorded
+            else:
+                if self.config.mode == 'replay':
+                    self.server.stats.add(replay_misses=1)
+                status, content_type, payload = 200, self._content_type(stream), self._canned(stream)
+        self._send(status, content_type, payload, stream)
+
+    def _content_type(self, stream):
+        return 'text/event-stream' if stream else 'application/json'
+
+    def _canned(self, stream):
+        if self.path == VL_PATH:
+            return vl_response(SAMPLE_OCR_TEXT, stream)
+        if self.path == CHAT_PATH:
+            return chat_response(json.dumps(SAMPLE_RESULT, ensure_ascii=False), stream)
+        return b'{}'
+
+    def _read_body(self):
+        remaining = int(self.headers.get('Content-Length') or 0)
+        chunks = []
+        total = 0
+        while remaining > 0:
+            chunk = self.rfile.read(min(IO_CHUNK, remaining))
+            if not chunk:
+                break
+            if not self.config.discard_body:
+                chunks.append(chunk)
+            total += len(chunk)
+            remaining -= len(chunk)
+            self._throttle(len(chunk))
+        if self.config.discard_body:
+            self.server.stats.add(bytes_in=total)
+        return b''.join(chunks)
+
+    def _throttle(self, size):
+        if self.config.bandwidth:
+            time.sleep(size / self.config.bandwidth)
+
+    def _send(self, status, content_type, payload, stream):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if not stream:
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            for i in range(0, len(payload), IO_CHUNK):
+                self.wfile.write(payload[i:i + IO_CHUNK])
+                self._throttle(min(IO_CHUNK, len(payload) - i))
+            self.server.stats.add(bytes_out=len(payload))
+            return
+
+        # 流式响应使用分块传输，每个 SSE 事件单独发送
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event in payload.split(b'\n\n'):
+            if not event.strip():
+                continue
+            event += b'\n\n'
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(event), event))
+            self.wfile.flush()
+            self._throttle(len(event))
+            if self.config.event_interval:
+                time.sleep(self.config.event_interval)
+        self.wfile.write(b'0\r\n\r\n')
+        self.server.stats.add(bytes_out=len(payload))
+
+    # --- record / replay ---
+    def _key(self, body):
+        return hashlib.sha256(self.path.encode('utf-8') + b'\0' + body).hexdigest()
+
+    def _forward(self, body):
+        import requests
+
+        # 只转发鉴权和流式相关的请求头，密钥不会写入录制文件
+        headers = {k: v for k, v in self.headers.items()
+                   if k.lower() in ('authorization', 'content-type', 'x-dashscope-sse', 'accept')}
+        resp = requests.post(UPSTREAMS.get(self.path, DEEPSEEK_BASE) + self.path, data=body,
+                             headers=headers, timeout=120)
+        return resp.status_code, resp.headers.get('Content-Type', 'application/json'), resp.content
+
+    def _save(self, body, status, content_type, payload):
+        os.makedirs(self.config.record_dir, exist_ok=True)
+        path = os.path.join(self.config.record_dir, self._key(body) + '.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'path': self.path, 'status': status, 'content_type': content_type,
+                       'body': payload.decode('utf-8', 'replace')}, f, ensure_ascii=False)
+
+    def _load(self, body):
+        path = os.path.join(self.config.record_dir or '', self._key(body) + '.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return data['status'], data['content_type'], data['body'].encode('utf-8')
+
+
+class MockServer:
+    """在后台线程运行的替身服务，base_url 可直接传给 ProviderClient。"""
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), MockHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.config = config or MockConfig()
+        self.httpd.stats = MockStats()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self):
+        return self.httpd.stats
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_config_args(parser, prefix=''):
+    parser.add_argument(f'--{prefix}latency', type=float, default=0.0, help='首字节延迟（秒）')
+    parser.add_argument(f'--{prefix}bandwidth', type=int, default=0, help='带宽（字节/秒），0 为不限')
+    parser.add_argument(f'--{prefix}error-rate', type=float, default=0.0, help='返回 503 的概率')
+    parser.add_argument(f'--{prefix}event-interval', type=float, default=0.0, help='流式事件间隔（秒）')
+
+
+def config_from_args(args, prefix='', mode='mock', record_dir=None, seed=None):
+    name = prefix.replace('-', '_')
+    return MockConfig(
+        latency=getattr(args, f'{name}latency'),
+        bandwidth=getattr(args, f'{name}bandwidth'),
+        error_rate=getattr(args, f'{name}error_rate'),
+        event_interval=getattr(args, f'{name}event_interval'),
+        mode=mode,
+        record_dir=record_dir,
+        seed=seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--mode', choices=('mock', 'record', 'replay'), default='mock')
+    parser.add_argument('--record-dir', default='recordings')
+    parser.add_argument('--seed', type=int)
+    add_config_args(parser)
+    args = parser.parse_args()
+
+    server = MockServer(config_from_args(args, mode=args.mode, record_dir=args.record_dir, seed=args.seed),
+                        port=args.port)
+    print(f"Mock provider listening on {server.base_url} ({args.mode})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(json.dumps(server.stats.snapshot()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""分位数回归检查：用几组小样本的已知结果核对 metrics.percentile（最近秩法），结果不符时退出码非 0。
+
+不需要 Kivy。示例：
+    python bench/percentile_check.py
+诊断页面、Metrics.export、run_bench.py 和 batch.py 的 p50/p95 都由此函数计算。
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import percentile  # noqa: E402
+
+# (样本, 分位, 期望值)；样本为 1..n 时第 k 个值即 k
+CASES = (
+    ([], 50, None),
+    ([7], 50, 7),
+    ([7], 95, 7),
+    ([1, 2], 50, 1),
+    ([2, 1], 95, 2),
+    ([1, 2, 3], 50, 2),
+    (list(range(1, 11)), 50, 5),
+    (list(range(1, 11)), 70, 7),
+    (list(range(1, 11)), 95, 10),
+    (list(range(1, 21)), 50, 10),
+    (list(range(1, 21)), 95, 19),
+    (list(range(1, 21)), 100, 20),
+    (list(range(1, 101)), 95, 95),
+    (list(range(1, 101)), 0, 1),
+)
+
+
+def main():
+    failures = []
+    for values, pct, expected in CASES:
+        got = percentile(values, pct)
+        if got != expected:
+            failures.append(f"n={len(values)} p{pct}: expected {expected}, got {got}")
+    for failure in failures:
+        print(failure)
+    print(f"{len(CASES) - len(failures)} passed, {len(failures)} failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""离线基准测试：用本地替身服务驱动 BackendService.analyze_report，输出 JSON 格式的性能指标。
+
+不需要 Kivy。示例：
+    python bench/run_bench.py --corpus samples/ --iterations 3 --dashscope-latency 0.8 --dashscope-bandwidth 250000
+指标包括单份报告耗时 p50/p95、吞吐量、上下行字节数和进程峰值 RSS。
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import percentile  # noqa: E402
+from mock_server import MockServer, SAMPLE_OCR_TEXT, add_config_args, config_from_args  # noqa: E402
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以 KB 为单位
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def load_corpus(paths):
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(sorted(p for p in glob.glob(os.path.join(path, '*')) if p.lower().endswith(IMAGE_EXTS)))
+        elif os.path.isfile(path):
+            images.append(path)
+    return images
+
+
+def synth_corpus(directory, count, size=(1240, 1754)):
+    # 未提供样例图片时生成模拟照片：深色桌面上略微倾斜的一页带表格文字的报告
+    from PIL import Image, ImageDraw
+
+    lines = SAMPLE_OCR_TEXT.encode('ascii', 'replace').decode('ascii').splitlines()
+    page_size = (size[0] * 4 // 5, size[1] * 4 // 5)
+    images = []
+    for n in range(count):
+        page = Image.new('RGB', page_size, (250, 250, 248))
+        draw = ImageDraw.Draw(page)
+        y = 100
+        for i in range(36):
+            draw.text((80, y), f"{i + n:03d}  {lines[i % len(lines)]}  {3.5 + i * 0.37:.2f}", fill=(20, 20, 20))
+            draw.line((80, y + 28, page_size[0] - 80, y + 28), fill=(120, 120, 120))
+            y += 36
+        page = page.rotate(1.5 + n % 3, expand=True, fillcolor=(70, 62, 55))
+        img = Image.new('RGB', size, (70, 62, 55))
+        img.paste(page, ((size[0] - page.width) // 2, (size[1] - page.height) // 2))
+        path = os.path.join(directory, f"synthetic_{n:02d}.jpg")
+        img.save(path, quality=90)
+        images.append(path)
+    return images
+
+
+def summarize(samples):
+    samples = [s for s in samples if s is not None]
+    if not samples:
+        return None
+    return {'p50': round(percentile(samples, 50), 2), 'p95': round(percentile(samples, 95), 2),
+            'min': round(min(samples), 2), 'max': round(max(samples), 2),
+            'mean': round(sum(samples) / len(samples), 2)}
+
+
+def run(args):
+    servers = {
+        'dashscope': MockServer(config_from_args(args, 'dashscope-', args.mode, args.record_dir, args.seed)).start(),
+        'deepseek': MockServer(config_from_args(args, 'deepseek-', args.mode, args.record_dir, args.seed)).start(),
+    }
+
+    # 在临时目录中运行，避免写入真实的历史库和缓存
+    workdir = tempfile.mkdtemp(prefix='medbench-')
+    corpus = load_corpus(args.corpus) or synth_corpus(workdir, args.synthetic)
+    os.chdir(workdir)
+
+    from core import AnalysisCore
+    from providers import ProviderClient
+
+    backend = AnalysisCore(workdir, workdir)
+    backend.ensure_ready()
+    backend.clients = {name: ProviderClient(server.base_url) for name, server in servers.items()}
+    keys = {'tongyi_key': args.tongyi_key, 'deepseek_key': args.deepseek_key}
+
+    def clear_caches():
+        for table in ('ocr_cache', 'result_cache'):
+            backend.db.execute(f'DELETE FROM {table}').result()
+
+    def analyze(path):
+        first = []
+        on_progress = None
+        if args.stream:
+            on_progress = lambda stage, fields: first or first.append(time.perf_counter())
+        start = time.perf_counter()
+        result = backend.analyze_report(path, keys, on_progress)
+        end = time.perf_counter()
+        return {
+            'ms': (end - start) * 1000,
+            'first_progress_ms': (first[0] - start) * 1000 if first else None,
+            'failed': backend.format_failed(result) or result.get('title') == backend.failed_result()['title'],
+        }
+
+    for _ in range(args.warmup):
+        analyze(corpus[0])
+    baseline = {name: server.stats.snapshot() for name, server in servers.items()}
+
+    samples = []
+    wall_start = time.perf_counter()
+    for _ in range(args.iterations):
+        if not args.warm_cache:
+            clear_caches()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            samples.extend(pool.map(analyze, corpus))
+    wall = time.perf_counter() - wall_start
+
+    traffic = {}
+    for name, server in servers.items():
+        stats = server.stats.snapshot()
+        traffic[name] = {k: v - baseline[name][k] for k, v in stats.items()}
+        server.stop()
+    backend.db.close()
+
+    reports = len(samples)
+    return {
+        'corpus': {'images': len(corpus), 'bytes': sum(os.path.getsize(p) for p in corpus)},
+        'config': {'iterations': args.iterations, 'concurrency': args.concurrency, 'stream': args.stream,
+                   'warm_cache': args.warm_cache, 'mode': args.mode,
+                   'image_options': backend.image_options},
+        'reports': reports,
+        'failures': sum(1 for s in samples if s['failed']),
+        'latency_ms': summarize([s['ms'] for s in samples]),
+        'first_progress_ms': summarize([s['first_progress_ms'] for s in samples]),
+        'throughput_per_s': round(reports / wall, 3) if wall else None,
+        'wall_s': round(wall, 3),
+        'traffic': traffic,
+        'bytes_per_report': {
+            'upload': round(sum(t['bytes_in'] for t in traffic.values()) / max(1, reports)),
+            'download': round(sum(t['bytes_out'] for t in traffic.values()) / max(1, reports)),
+        },
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', nargs='*', default=[], help='样例图片文件或目录')
+    parser.add_argument('--synthetic', type=int, default=4, help='未提供样例时生成的模拟页数')
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--stream', action='store_true', help='使用流式接口并统计首个进度回调耗时')
+    parser.add_argument('--warm-cache', action='store_true', help='保留识别和整理缓存')
+    parser.add_argument('--mode', choices=('mock', 'record', 'replay'), default='mock')
+    parser.add_argument('--record-dir', default='recordings')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tongyi-key', default=os.environ.get('TONGYI_KEY', 'bench'))
+    parser.add_argument('--deepseek-key', default=os.environ.get('DEEPSEEK_KEY', 'bench'))
+    parser.add_argument('--out', help='结果写入文件，默认输出到标准输出')
+    add_config_args(parser, 'dashscope-')
+    add_config_args(parser, 'deepseek-')
+    args = parser.parse_args()
+    args.record_dir = os.path.abspath(args.record_dir)
+    args.corpus = [os.path.abspath(p) for p in args.corpus]
+    out = os.path.abspath(args.out) if args.out else None
+
+    report = json.dumps(run(args), ensure_ascii=False, indent=2)
+    if out:
+        with open(out, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
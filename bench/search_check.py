@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""历史搜索回归检查：在临时库中写入几条记录，分别走全文索引和 LIKE 回退两条路径搜索，结果不符时退出码非 0。
+
+不需要 Kivy。示例：
+    python bench/search_check.py
+两个字的中文词（如“血糖”）低于 trigram 索引的最短长度，总是走 LIKE 回退；未编译 FTS5 的 SQLite 也只走回退。
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core import AnalysisCore  # noqa: E402
+
+RECORDS = (
+    {'title': '血糖检查', 'core_conclusion': '空腹血糖偏高', 'abnormal_analysis': '葡萄糖 7.2 mmol/L'},
+    {'title': '血常规', 'core_conclusion': '白细胞计数正常', 'abnormal_analysis': '血红蛋白 135 g/L'},
+    {'title': '肝功能', 'core_conclusion': '转氨酶正常', 'life_advice': '注意饮食，少饮酒'},
+)
+# (查询, 应命中的标题)
+CASES = (
+    ('血糖', {'血糖检查'}),
+    ('正常', {'血常规', '肝功能'}),
+    ('血 正常', {'血常规'}),
+    ('白细胞计数', {'血常规'}),
+    ('饮酒', {'肝功能'}),
+    ('尿酸', set()),
+)
+
+
+def check(core, fts):
+    core.db.fts_enabled = fts
+    failures = []
+    for query, expected in CASES:
+        titles = {row[2] for row in core.search_history(query)}
+        if titles != expected:
+            failures.append(f"fts={fts} {query!r}: expected {sorted(expected)}, got {sorted(titles)}")
+    return failures
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='searchcheck-')
+    try:
+        core = AnalysisCore(workdir, workdir)
+        for record in RECORDS:
+            core.save_record(record).result()
+        available = core.db.fts_enabled
+        failures = check(core, False)
+        if available:
+            failures += check(core, True)
+        core.db.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for failure in failures:
+        print(failure)
+    print(f"{len(CASES) * (2 if available else 1) - len(failures)} passed, {len(failures)} failed"
+          + ('' if available else ' (FTS5 unavailable, LIKE fallback only)'))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
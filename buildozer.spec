@@ -15,11 +15,17 @@ source.dir = .
 # (list) Source files to include (let empty to include all the files)
 source.include_exts = py,png,jpg,kv,atlas,ttf,ini
 
+# (list) List of directory to exclude (let empty to not exclude anything)
+source.exclude_dirs = bench
+
+# (list) List of exclusions using pattern matching
+source.exclude_patterns = batch.py
+
 # (str) Application versioning (method 1)
 version = 0.3
 
 # (list) Application requirements
-requirements = python3,kivy==2.3.0,kivymd==1.1.1,requests,pillow,android,pyjnius,urllib3,sqlite3
+requirements = python3,kivy==2.3.0,kivymd==1.1.1,requests,pillow,numpy,android,pyjnius,urllib3,sqlite3
 
 # (str) Supported orientation (one of landscape, sensorLandscape, portrait or all)
 orientation = portrait
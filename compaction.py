@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import re
+import unicodedata
+
+# 整理阶段输入的默认 token 预算
+DEFAULT_TOKEN_BUDGET = 2000
+
+# 医院抬头、签名、页脚等与解读无关的固定内容
+BOILERPLATE = [re.compile(p) for p in (
+    r'^(地址|电话|传真|网址|邮编|官网|微信|热线)[:：]',
+    r'(本|此)(报告|结果)(仅|只)对(此|所检|送检)?(标本|样本)负责',
+    r'(仅供|只供)(临床)?参考',
+    r'如有(疑问|异议)',
+    r'^(检验|审核|报告|送检|采样|录入|复核|核对)(者|人|医生|医师|日期|时间)[:：]',
+    r'^(打印|接收|采集|签收)(时间|日期)[:：]',
+    r'^第\s*\d+\s*页\s*(/|共)\s*\d+\s*页?$',
+    r'^(条码号|条形码|标本号|样本号|流水号|申请单号)[:：]',
+    r'^(扫码|扫描二维码)',
+)]
+
+_TABLE_RULE = re.compile(r'^[\s|:\-+=]+$')
+_SPACES = re.compile(r'[ \t　\xa0]+')
+_RESULT_HINT = re.compile(r'\d+(?:\.\d+)?\s*(?:[-~]\s*\d+(?:\.\d+)?|[↑↓HL]\b)|[↑↓]|偏高|偏低|阳性|异常')
+_DIGIT = re.compile(r'\d')
+
+
+def estimate_tokens(text):
+    # DeepSeek 官方换算：1 个中文字符约 0.6 token，1 个英文字符约 0.3 token
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3 + 0.999)
+
+
+def _normalize_line(line):
+    # NFKC 把全角数字、字母和标点统一为半角
+    line = unicodedata.normalize('NFKC', line)
+    if '|' in line:
+        if _TABLE_RULE.match(line):
+            return ''
+        line = ' '.join(cell.strip() for cell in line.strip().strip('|').split('|') if cell.strip())
+    line = line.strip().strip('*#>').strip()
+    return _SPACES.sub(' ', line)
+
+
+def _priority(line):
+    # 带参考范围或异常标记的检验结果最重要，其次是含数字的行，纯文字说明最先舍弃
+    if _RESULT_HINT.search(line):
+        return 2
+    if _DIGIT.search(line):
+        return 1
+    return 0
+
+
+def compact_text(text, budget=DEFAULT_TOKEN_BUDGET):
+    """压缩识别文字以适配 token 预算，返回 (文字, 统计)。"""
+    raw = str(text or '')
+    lines = []
+    seen = set()
+    for line in raw.splitlines():
+        line = _normalize_line(line)
+        if not line or line in seen:
+            continue
+        if any(p.search(line) for p in BOILERPLATE):
+            continue
+        seen.add(line)
+        lines.append(line)
+
+    costs = [estimate_tokens(line) + 1 for line in lines]
+    total = sum(costs)
+    keep = [True] * len(lines)
+    dropped = 0
+    if budget and total > budget:
+        # 按优先级从低到高、同级从后往前舍弃，保留原有行序
+        order = sorted(range(len(lines)), key=lambda i: (_priority(lines[i]), -i))
+        for i in order:
+            if total <= budget:
+                break
+            keep[i] = False
+            total -= costs[i]
+            dropped += 1
+
+    result = '\n'.join(line for line, k in zip(lines, keep) if k)
+    stats = {
+        'chars_in': len(raw),
+        'chars_out': len(result),
+        'tokens_in': estimate_tokens(raw),
+        'tokens_out': estimate_tokens(result),
+        'dropped_lines': dropped,
+    }
+    return result, stats
+
+
+_PAGE_MARK = re.compile(r'^【第\d+页】')
+
+
+def split_sections(text, chunk_budget=DEFAULT_TOKEN_BUDGET):
+    """按页标记和 token 预算把文字切分为若干段，段内保持行序。"""
+    chunks = []
+    current = []
+    used = 0
+    for line in str(text or '').splitlines():
+        cost = estimate_tokens(line) + 1
+        # 超出单段预算时另起一段；已过半预算时优先在页边界切分
+        page_break = _PAGE_MARK.match(line) and used > chunk_budget // 2
+        if current and (page_break or used + cost > chunk_budget):
+            chunks.append('\n'.join(current))
+            current, used = [], 0
+        current.append(line)
+        used += cost
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
@@ -0,0 +1,902 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from archive import ARCHIVE_SUFFIX, export_archive, import_archive
+from compaction import DEFAULT_TOKEN_BUDGET, compact_text, split_sections
+from imagecache import ImageCache
+from imaging import DEFAULT_IMAGE_OPTIONS, assess_quality, load_modules, open_preprocessed
+from jobs import JobQueue
+from labs import extract_lab_items
+from metrics import Metrics
+from providers import (CHAT_PATH, DATA_URL, DEFAULT_DEADLINE, VL_PATH, Cancelled, DeadlineExceeded, create_clients,
+                       is_timeout, iter_sse, json_body, warm_up_async)
+from storage import Database, content_key, decode_payload, decode_text, encode_payload
+
+
+# 分析缓存：默认保留 30 天，每张表最多 200 条 / 8MB
+CACHE_TTL = 30 * 24 * 3600
+CACHE_MAX_ROWS = 200
+CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+FORMAT_FAILED = "AI整理失败，显示原文"
+
+# 多页报告并发识别的线程数上限
+BATCH_WORKERS = 3
+# 长报告分段摘要（map 阶段）的并发数上限
+MAP_WORKERS = 4
+
+# 历史记录分页大小与已解码记录的 LRU 容量
+HISTORY_PAGE_SIZE = 30
+RECORD_CACHE_SIZE = 32
+
+# 历史记录保留策略：条数 / 压缩后总字节数 / 天数，None 表示不限制
+DEFAULT_RETENTION = {
+    'max_rows': 5000,
+    'max_bytes': 64 * 1024 * 1024,
+    'max_age_days': None,
+}
+# 旧版本直接写入缓存目录的拍照和相册副本（cam_*.jpg / gallery_*.jpg）保留的时间
+IMAGE_MAX_AGE = 24 * 3600
+
+# 搜索结果中命中片段的起止标记，由界面层转换为高亮样式
+HIT_START = '\ue000'
+HIT_END = '\ue001'
+
+RESULT_FIELDS = ('title', 'core_conclusion', 'abnormal_analysis', 'life_advice')
+# 由后台初始化线程创建的属性，见 AnalysisCore.__getattr__
+LAZY_ATTRS = ('db', 'clients', 'jobs', 'images', 'record_cache', 'record_lock', 'saves_since_maintenance')
+# LIKE 检索的拼接文本，单独定义避免在 SQL 字符串中嵌套引号
+_SEARCH_TEXT = "ifnull(title, '') || ifnull(summary, '') || ifnull(decode_text(full_json), '')"
+_JSON_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+
+
+def parse_partial_fields(buf):
+    # 从尚未输出完整的 JSON 中提取已生成的字符串字段，用于流式渲染
+    fields = {}
+    for name in RESULT_FIELDS:
+        m = re.search(r'"%s"\s*:\s*"' % name, buf)
+        if not m:
+            continue
+        i, n, out = m.end(), len(buf), []
+        while i < n:
+            c = buf[i]
+            if c == '"':
+                break
+            if c == '\\':
+                if i + 1 >= n:
+                    break
+                esc = buf[i + 1]
+                if esc == 'u':
+                    code = buf[i + 2:i + 6]
+                    if len(code) < 4:
+                        break
+                    try:
+                        out.append(chr(int(code, 16)))
+                    except ValueError:
+                        pass
+                    i += 6
+                    continue
+                out.append(_JSON_ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            out.append(c)
+            i += 1
+        fields[name] = ''.join(out)
+    return fields
+
+
+class AnalysisCore:
+    """识别、整理和历史记录持久化，不依赖 Kivy，可在服务器或批处理进程中直接使用。
+
+    files_dir 存放历史数据库，cache_dir 存放图片副本和导出的归档；数据库、网络客户端等在首次访问时创建，
+    或由 start_background() 在后台线程中创建。相机、相册、TTS 等应用内功能见 backend.BackendService。
+    """
+
+    def __init__(self, files_dir='.', cache_dir='.'):
+        self.files_dir = files_dir
+        self.cache_dir = cache_dir
+        self._init()
+
+    def _init(self):
+        self.image_options = dict(DEFAULT_IMAGE_OPTIONS)
+        self.metrics = Metrics(None)
+        # 对冲延迟（秒）：None 为顺序执行，0 为两条路线同时发起
+        self.hedge_delay = None
+        # 单次分析从识别到整理的总时间预算（秒）
+        self.deadline = DEFAULT_DEADLINE
+        self.retention = dict(DEFAULT_RETENTION)
+        self.prompt_budget = DEFAULT_TOKEN_BUDGET
+        # 超出预算的长报告先分段摘要再汇总，关闭时直接按预算截取
+        self.map_reduce = True
+        # 每保存 20 条记录在后台执行一次维护（保留策略、清理图片副本、回收空间）
+        self.auto_maintenance = True
+        self._ready = threading.Event()
+        self._setup_lock = threading.RLock()
+        self._maintenance_lock = threading.Lock()
+        self._setting_up = False
+
+    def __getattr__(self, name):
+        # 数据库、网络客户端等由 start_background() 在后台创建；完成前访问时等待，
+        # 未启动后台初始化时（如基准测试脚本）就地同步初始化
+        if name in LAZY_ATTRS and '_setup_lock' in self.__dict__:
+            self.ensure_ready()
+            if name in self.__dict__:
+                return self.__dict__[name]
+        raise AttributeError(name)
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def ensure_ready(self):
+        if self._ready.is_set():
+            return
+        with self._setup_lock:
+            # 初始化线程内部的重入访问直接返回，由 __getattr__ 抛出 AttributeError
+            if self._ready.is_set() or self._setting_up:
+                return
+            self._setting_up = True
+            try:
+                self._setup()
+            finally:
+                self._setting_up = False
+            self._ready.set()
+
+    def start_background(self, on_ready=None):
+        # on_ready 在初始化线程中回调
+        def run():
+            try:
+                self.ensure_ready()
+            except Exception as e:
+                print(f"Backend Init Error: {e}")
+                return
+            if on_ready:
+                on_ready()
+
+        threading.Thread(target=run, name='backend-init', daemon=True).start()
+
+    def _setup(self):
+        # 耗时的初始化：导入网络与图像库、打开数据库
+        start = time.perf_counter()
+        self._setup_services()
+        self.metrics.record('startup', (time.perf_counter() - start) * 1000, 'backend_init')
+
+    def _setup_services(self):
+        self.clients = create_clients()
+        self.setup_db()
+        self.jobs = JobQueue(self, lambda: {})
+        self.images = ImageCache(os.path.join(self.get_cache_dir(), 'images'))
+        load_modules()
+
+    def get_files_dir(self):
+        return self.files_dir
+
+    def get_cache_dir(self):
+        return self.cache_dir
+
+    def start_jobs(self, keys_provider, listener=None):
+        self.jobs.keys_provider = keys_provider
+        self.jobs.listener = listener
+        self.jobs.start()
+        return self.jobs.pending_count()
+
+    def warm_up(self):
+        return warm_up_async(self.clients)
+
+    # --- Database ---
+    def setup_db(self):
+        db_path = os.path.join(self.get_files_dir(), 'medical_history.db')
+        self.db = Database(db_path)
+        self.metrics.db = self.db
+        self.record_cache = OrderedDict()
+        self.record_lock = threading.Lock()
+        self.prune_cache()
+        self.saves_since_maintenance = 0
+
+    def start_maintenance(self):
+        if self._maintenance_lock.locked():
+            return
+        threading.Thread(target=self.run_maintenance, daemon=True).start()
+
+    def run_maintenance(self):
+        # 后台执行：回填检验项目 -> 保留策略 -> 清理图片副本 -> 增量回收空闲页
+        # 同一时间只运行一次，上一次未结束时直接跳过，避免多次维护同时删除、回收而争锁
+        if not self._maintenance_lock.acquire(blocking=False):
+            return
+        try:
+            indexed = self.backfill_lab_values()
+            if indexed:
+                print(f"[DB] extracted lab values for {indexed} records")
+            removed = self.db.submit(self._apply_retention).result()
+            self.metrics.prune()
+            removed_files = self.prune_image_files()
+            removed_files += self.images.evict(self.jobs.active_paths())
+            freed = self.db.compact()
+            print(f"[DB] retention removed {removed} rows, {removed_files} images, freed {freed} pages")
+        except Exception as e:
+            print(f"DB Maintenance Error: {e}")
+        finally:
+            self._maintenance_lock.release()
+
+    def _apply_retention(self, conn):
+        policy = self.retention
+        removed = 0
+        if policy.get('max_age_days'):
+            cutoff = int(time.time() - policy['max_age_days'] * 86400)
+            removed += conn.execute('DELETE FROM history WHERE created_at < ?', (cutoff,)).rowcount
+        if policy.get('max_rows'):
+            removed += conn.execute('''
+                DELETE FROM history WHERE id <= (
+                    SELECT id FROM history ORDER BY id DESC LIMIT 1 OFFSET ?
+                )
+            ''', (policy['max_rows'],)).rowcount
+        if policy.get('max_bytes'):
+            removed += conn.execute('''
+                DELETE FROM history WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, SUM(length(full_json)) OVER (ORDER BY id DESC) AS total FROM history
+                    ) WHERE total > ?
+                )
+            ''', (policy['max_bytes'],)).rowcount
+        return removed
+
+    def prune_image_files(self):
+        cache_dir = self.get_cache_dir()
+        cutoff = time.time() - IMAGE_MAX_AGE
+        removed = 0
+        for name in os.listdir(cache_dir):
+            if not (name.startswith('cam_') or name.startswith('gallery_')) or not name.endswith('.jpg'):
+                continue
+            path = os.path.join(cache_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def save_record(self, result_data):
+        # 写入由数据库写线程异步提交，返回 Future，调用方可按需等待新记录 id
+        try:
+            now = datetime.now()
+            title = result_data.get('title', '未命名报告')
+            summary = result_data.get('core_conclusion', '')
+            payload = encode_payload(result_data)
+            created_at = int(now.timestamp())
+            key = content_key(created_at, decode_text(payload))
+            lab_items = extract_lab_items(result_data)
+
+            def insert(conn):
+                with self.metrics.span('db_write', nbytes=len(payload)):
+                    record_id = conn.execute(
+                        'INSERT INTO history (date_str, title, summary, full_json, created_at, labs_indexed, '
+                        'content_key) VALUES (?, ?, ?, ?, ?, 1, ?)',
+                        (now.strftime("%Y-%m-%d %H:%M"), title, summary, payload, created_at, key)
+                    ).lastrowid
+                    self._insert_lab_items(conn, record_id, created_at, lab_items)
+                return record_id
+
+            fut = self.db.submit(insert)
+            self.saves_since_maintenance += 1
+            if self.auto_maintenance and self.saves_since_maintenance >= 20:
+                self.saves_since_maintenance = 0
+                self.start_maintenance()
+            return fut
+        except Exception as e:
+            print(f"DB Save Error: {e}")
+
+    @staticmethod
+    def _insert_lab_items(conn, record_id, created_at, items):
+        if not items:
+            return
+        conn.executemany('''
+            INSERT INTO lab_values (record_id, test_key, test_name, value, value_text, unit,
+                                    ref_low, ref_high, ref_text, flag, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(record_id, i['test_key'], i['test_name'], i['value'], i['value_text'], i['unit'],
+               i['ref_low'], i['ref_high'], i['ref_text'], i['flag'], created_at) for i in items])
+
+    def backfill_lab_values(self, chunk=100):
+        # 为旧记录补提取检验项目，分块提交，不长时间占用写线程
+        total = 0
+        while True:
+            done = self.db.submit(lambda conn: self._backfill_chunk(conn, chunk)).result()
+            if not done:
+                return total
+            total += done
+
+    def _backfill_chunk(self, conn, chunk):
+        rows = conn.execute(
+            'SELECT id, created_at, full_json FROM history WHERE labs_indexed = 0 LIMIT ?', (chunk,)).fetchall()
+        for record_id, created_at, full_json in rows:
+            try:
+                items = extract_lab_items(decode_payload(full_json) or {})
+            except Exception as e:
+                print(f"Lab Backfill Error ({record_id}): {e}")
+                items = []
+            conn.execute('DELETE FROM lab_values WHERE record_id = ?', (record_id,))
+            self._insert_lab_items(conn, record_id, created_at, items)
+            conn.execute('UPDATE history SET labs_indexed = 1 WHERE id = ?', (record_id,))
+        return len(rows)
+
+    def get_lab_tests(self):
+        # [(test_key, 显示名称, 次数)]，按检测次数排序
+        try:
+            return self.db.query('''
+                SELECT test_key, MAX(test_name), COUNT(*) AS n FROM lab_values
+                GROUP BY test_key ORDER BY n DESC, test_key
+            ''')
+        except Exception as e:
+            print(f"Lab Query Error: {e}")
+            return []
+
+    def get_lab_trend(self, key, limit=100):
+        # 走 (test_key, created_at) 索引，返回按时间排序的 [(created_at, value, unit, ref_low, ref_high, flag, record_id)]
+        try:
+            rows = self.db.query('''
+                SELECT created_at, value, unit, ref_low, ref_high, flag, record_id FROM lab_values
+                WHERE test_key = ? ORDER BY created_at DESC LIMIT ?
+            ''', (key, limit))
+            return rows[::-1]
+        except Exception as e:
+            print(f"Lab Query Error: {e}")
+            return []
+
+    def get_history_page(self, before_id=None, limit=HISTORY_PAGE_SIZE):
+        # 按 id 键集分页，只取列表需要的列，full_json 在打开时再按 id 读取
+        try:
+            if before_id is None:
+                return self.db.query(
+                    'SELECT id, date_str, title, summary FROM history ORDER BY id DESC LIMIT ?', (limit,))
+            return self.db.query(
+                'SELECT id, date_str, title, summary FROM history WHERE id < ? ORDER BY id DESC LIMIT ?',
+                (before_id, limit))
+        except Exception as e:
+            print(f"DB Page Error: {e}")
+            return []
+
+    def get_record(self, record_id):
+        with self.record_lock:
+            if record_id in self.record_cache:
+                self.record_cache.move_to_end(record_id)
+                return self.record_cache[record_id]
+        try:
+            row = self.db.query_one('SELECT full_json FROM history WHERE id = ?', (record_id,))
+            if not row:
+                return None
+            data = decode_payload(row[0])
+        except Exception as e:
+            print(f"DB Record Error: {e}")
+            return None
+
+        with self.record_lock:
+            self.record_cache[record_id] = data
+            if len(self.record_cache) > RECORD_CACHE_SIZE:
+                self.record_cache.popitem(last=False)
+        return data
+
+    def search_history(self, query, limit=50):
+        # 返回 [(id, date_str, title, snippet)]，按相关度排序
+        terms = query.split()
+        if not terms:
+            return []
+        try:
+            # trigram 索引只能匹配 3 个字符及以上的词，更短的词走 LIKE 扫描
+            if self.db.fts_enabled and all(len(t) >= 3 for t in terms):
+                match = ' '.join('"%s"' % t.replace('"', '""') for t in terms)
+                return self.db.query(f'''
+                    SELECT h.id, h.date_str, h.title,
+                           snippet(history_fts, -1, '{HIT_START}', '{HIT_END}', '…', 12)
+                    FROM history_fts JOIN history h ON h.id = history_fts.rowid
+                    WHERE history_fts MATCH ?
+                    ORDER BY rank LIMIT ?
+                ''', (match, limit))
+
+            where = ' AND '.join([f'({_SEARCH_TEXT}) LIKE ?'] * len(terms))
+            rows = self.db.query(
+                f'SELECT id, date_str, title, summary FROM history WHERE {where} ORDER BY id DESC LIMIT ?',
+                [f'%{t}%' for t in terms] + [limit])
+            return [(r[0], r[1], r[2], self._mark_hits(r[3] or '', terms)) for r in rows]
+        except Exception as e:
+            print(f"Search Error: {e}")
+            return []
+
+    @staticmethod
+    def _mark_hits(text, terms):
+        for t in terms:
+            text = text.replace(t, f'{HIT_START}{t}{HIT_END}')
+        return text
+
+    # --- Archive ---
+    def export_history(self, include_images=False):
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(self.get_cache_dir(), f"history_{stamp}{ARCHIVE_SUFFIX}")
+        stats = export_archive(self.db, path, include_images)
+        stats['path'] = path
+        print(f"[ARCHIVE] exported {stats['records']} records ({stats['bytes']} bytes) in {stats['ms']:.0f} ms")
+        return stats
+
+    def find_archive(self):
+        # 导入缓存目录中最新的归档文件（从其他设备拷贝过来或本机导出的）
+        cache_dir = self.get_cache_dir()
+        archives = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(ARCHIVE_SUFFIX)]
+        return max(archives, key=os.path.getmtime) if archives else None
+
+    def import_history(self, path):
+        stats = import_archive(self.db, path)
+        print(f"[ARCHIVE] imported {stats['imported']}/{stats['records']} records "
+              f"({stats['duplicates']} duplicates, {stats['errors']} errors) in {stats['ms']:.0f} ms")
+        if stats['imported']:
+            # 后台补提取检验项目并执行保留策略
+            self.start_maintenance()
+        return stats
+
+    # --- Analysis Cache ---
+    @staticmethod
+    def hash_file(path):
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def hash_text(text):
+        normalized = ' '.join(str(text).split())
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def cache_get(self, table, key):
+        try:
+            row = self.db.query_one(f'SELECT value, created FROM {table} WHERE key = ?', (key,))
+            if not row:
+                return None
+            now = time.time()
+            if now - row[1] > CACHE_TTL:
+                self.db.execute(f'DELETE FROM {table} WHERE key = ?', (key,))
+                return None
+            self.db.execute(f'UPDATE {table} SET last_used = ? WHERE key = ?', (now, key))
+            return row[0]
+        except Exception as e:
+            print(f"Cache Read Error: {e}")
+            return None
+
+    def cache_put(self, table, key, value):
+        now = time.time()
+        self.db.execute(
+            f'INSERT OR REPLACE INTO {table} (key, value, size, created, last_used) VALUES (?, ?, ?, ?, ?)',
+            (key, value, len(value.encode('utf-8')), now, now)
+        )
+        self.prune_cache(table)
+
+    def prune_cache(self, table=None):
+        tables = [table] if table else ['ocr_cache', 'result_cache']
+
+        def prune(conn):
+            for t in tables:
+                conn.execute(f'DELETE FROM {t} WHERE created < ?', (time.time() - CACHE_TTL,))
+                # 按最近使用时间淘汰，直到行数和体积都在限额内
+                conn.execute(f'''
+                    DELETE FROM {t} WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key,
+                                   ROW_NUMBER() OVER (ORDER BY last_used DESC) AS rn,
+                                   SUM(size) OVER (ORDER BY last_used DESC) AS total
+                            FROM {t}
+                        ) WHERE rn > ? OR total > ?
+                    )
+                ''', (CACHE_MAX_ROWS, CACHE_MAX_BYTES))
+
+        return self.db.submit(prune)
+
+    # --- AI & OCR ---
+    def analyze_report(self, image_path, keys, on_progress=None, handle=None):
+        # on_progress(stage, fields)：stage 为 'extract' 或 'format'，fields 为已生成的部分结果
+        # handle 为 AnalysisHandle 时所有请求共用其截止时间，取消后抛出 Cancelled
+        return self.analyze_batch([image_path], keys, on_progress, handle=handle)
+
+    def analyze_batch(self, image_paths, keys, on_progress=None, max_workers=BATCH_WORKERS, handle=None):
+        rejected = self.precheck(image_paths, keys)
+        if rejected:
+            return rejected
+        text = self.extract_pages(image_paths, keys, on_progress, max_workers, handle)
+        if not text:
+            return self.failed_result()
+        return self.format_text(text, keys, on_progress, handle)
+
+    def precheck(self, image_paths, keys):
+        # 返回需要直接展示给用户的结果（缺少密钥、照片不合格），检查通过时返回 None
+        if not keys.get('tongyi_key') and not keys.get('ali_ak'):
+            return self._missing_keys_result()
+        return self._check_quality(image_paths)
+
+    def extract_pages(self, image_paths, keys, on_progress=None, max_workers=BATCH_WORKERS, handle=None):
+        with self.metrics.span('extract') as span:
+            text = self._extract_pages(image_paths, keys, on_progress, max_workers, handle)
+            if not text:
+                span.outcome = 'empty'
+        return text
+
+    def _extract_pages(self, image_paths, keys, on_progress, max_workers, handle):
+        if len(image_paths) == 1:
+            on_text = None
+            if on_progress:
+                on_text = lambda text: on_progress('extract', {'abnormal_analysis': text})
+            return self._extract_text(image_paths[0], keys, on_text, handle)
+
+        # 多页报告：各页并发识别，按页码顺序合并后只调用一次整理接口
+        total = len(image_paths)
+        texts = [None] * total
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, total))) as pool:
+            futures = {pool.submit(self._extract_text, p, keys, None, handle): i for i, p in enumerate(image_paths)}
+            for fut in as_completed(futures):
+                try:
+                    texts[futures[fut]] = fut.result()
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    print(f"Page Extract Error: {e}")
+                done += 1
+                if on_progress:
+                    on_progress('page', {'done': done, 'total': total})
+
+        pages = [f"【第{i + 1}页】\n{t}" for i, t in enumerate(texts) if t]
+        return "\n\n".join(pages) or None
+
+    def format_text(self, text, keys, on_progress=None, handle=None):
+        with self.metrics.span('format') as span:
+            result = self._format_cached(text, keys.get('deepseek_key'), on_progress, handle)
+            if self.format_failed(result):
+                span.outcome = 'failed'
+        return result
+
+    def _missing_keys_result(self):
+        return {"title": "配置错误", "core_conclusion": "未检测到API密钥",
+                "abnormal_analysis": "请在设置中输入通义千问Key或阿里云Key"}
+
+    def _check_quality(self, image_paths):
+        # 联网前先在本地拦截模糊或过暗的照片
+        bad = []
+        for i, path in enumerate(image_paths):
+            ok, reason, metrics = assess_quality(path, self.image_options)
+            if not ok:
+                print(f"[QUALITY] page {i + 1} rejected: {reason} {metrics}")
+                bad.append((i + 1, reason))
+        if not bad:
+            return None
+
+        reasons = {'blurry': "照片模糊", 'low_contrast': "光线不足或对比度过低"}
+        if len(image_paths) == 1:
+            detail = reasons.get(bad[0][1], "照片质量不佳")
+        else:
+            detail = "；".join(f"第{n}页{reasons.get(r, '质量不佳')}" for n, r in bad)
+        return {"title": "图片不清晰", "core_conclusion": detail,
+                "life_advice": "请在光线充足处对焦后重新拍摄"}
+
+    def format_failed(self, result):
+        return result.get('core_conclusion') == FORMAT_FAILED
+
+    def failed_result(self):
+        return {"title": "分析失败", "core_conclusion": "无法识别图片内容", "life_advice": "请尝试重拍，保证文字清晰"}
+
+    def timeout_result(self):
+        return {"title": "分析超时", "core_conclusion": "网络响应过慢，分析未能按时完成", "life_advice": "请检查网络后重试"}
+
+    def cancelled_result(self):
+        return {"title": "已取消", "core_conclusion": "分析已取消"}
+
+    def _extract_text(self, image_path, keys, on_text=None, handle=None):
+        ty_key = keys.get('tongyi_key')
+        ds_key = keys.get('deepseek_key')
+        ak = keys.get('ali_ak')
+        sk = keys.get('ali_sk')
+
+        try:
+            # 导入时已按内容哈希命名的图片不必再次读取
+            image_key = self.images.key_for(image_path)
+            if image_key is None:
+                with self.metrics.span('read', nbytes=os.path.getsize(image_path)):
+                    image_key = self.hash_file(image_path)
+        except Exception as e:
+            print(f"Hash Error: {e}")
+            image_key = None
+
+        # 同一张图片重复扫描时直接使用缓存的识别文字
+        cached_text = self.cache_get('ocr_cache', image_key) if image_key else None
+        if cached_text:
+            return cached_text
+
+        routes = []
+        # 方案 A: 通义千问 VL
+        if ty_key:
+            routes.append(('vl', lambda: self._call_tongyi_vl(image_path, ty_key, on_text, handle)))
+        # 方案 B: 阿里云OCR
+        if ak and sk and ds_key:
+            routes.append(('ocr', lambda: self._call_aliyun_ocr(image_path, ak, sk)))
+
+        if len(routes) > 1 and self.hedge_delay is not None:
+            text = self._run_hedged(routes, self.hedge_delay)
+        else:
+            text = None
+            for name, fn in routes:
+                text = fn()
+                if text:
+                    break
+        if not text and handle:
+            # 路线因取消或超时失败时不再按普通失败处理
+            handle.check()
+
+        if text and image_key:
+            self.cache_put('ocr_cache', image_key, text)
+        return text
+
+    def _run_hedged(self, routes, delay):
+        # 主路线先发起，超过 delay 秒未返回（或已失败）时启动备用路线，取最先成功的结果
+        results = queue.Queue()
+        state = {'winner': None, 'at': None}
+        lock = threading.Lock()
+        start = time.perf_counter()
+
+        def run(name, fn):
+            try:
+                text = fn()
+            except Exception as e:
+                print(f"Route {name} Error: {e}")
+                text = None
+            elapsed = time.perf_counter() - start
+            with lock:
+                winner, won_at = state['winner'], state['at']
+            if winner and text:
+                print(f"[HEDGE] {winner} won by {(elapsed - won_at) * 1000:.0f} ms over {name}")
+            results.put((name, text, elapsed))
+
+        def launch(index):
+            name, fn = routes[index]
+            threading.Thread(target=run, args=(name, fn), daemon=True).start()
+
+        launch(0)
+        launched, finished = 1, 0
+        while finished < launched:
+            timeout = None
+            if launched < len(routes):
+                timeout = max(0, delay - (time.perf_counter() - start))
+            try:
+                name, text, elapsed = results.get(timeout=timeout)
+            except queue.Empty:
+                launch(launched)
+                launched += 1
+                continue
+
+            finished += 1
+            if text:
+                with lock:
+                    state['winner'], state['at'] = name, elapsed
+                print(f"[HEDGE] {name} won after {elapsed * 1000:.0f} ms "
+                      f"({launched - finished} route(s) still running)")
+                return text
+            if launched < len(routes):
+                launch(launched)
+                launched += 1
+        return None
+
+    def _call_tongyi_vl(self, path, key, on_text=None, handle=None):
+        try:
+            with self.metrics.span('preprocess', 'dashscope') as span:
+                image, mime, stats = open_preprocessed(path, self.image_options)
+                span.bytes = stats['out_bytes']
+            print(f"[IMG] {stats['src_bytes']} -> {stats['out_bytes']} bytes "
+                  f"(saved {stats['saved_bytes']}, {stats['ms']:.0f} ms)")
+            data = {
+                "model": "qwen-vl-max",
+                "input": {"messages": [{"role": "user", "content": [
+                    {"image": DATA_URL},
+                    {"text": "提取这张医疗报告的所有文字信息"}
+                ]}]}
+            }
+            headers = {"Authorization": f"Bearer {key}"}
+            # 图片在上传时分块读取并编码为 base64，见 providers.json_body
+            attachment = (image, stats['out_bytes'], mime)
+            with image:
+                if on_text:
+                    return self._stream_tongyi_vl(data, headers, on_text, handle, attachment)
+
+                # 识别最多占用剩余预算的 60%，其余留给整理阶段
+                with self._post_json('dashscope', VL_PATH, data, headers, attachment, handle=handle, share=0.6,
+                                     timeout=35) as resp:
+                    if resp.status_code != 200:
+                        return None
+                    raw = self._receive(resp, 'dashscope')
+            with self.metrics.span('parse', 'dashscope'):
+                return json.loads(raw)['output']['choices'][0]['message']['content'][0]['text']
+        except Cancelled:
+            raise
+        except Exception as e:
+            # 取消时关闭连接会让读取报错，这里统一转换为 Cancelled
+            if handle:
+                handle.check()
+                # 识别阶段用完了它的预算份额：按超时处理，不当作图片无法识别而提示重拍
+                if is_timeout(e):
+                    raise DeadlineExceeded() from e
+        return None
+
+    def _stream_tongyi_vl(self, data, headers, on_text, handle=None, attachment=None):
+        headers = dict(headers, **{"X-DashScope-SSE": "enable"})
+        data = dict(data, parameters={"incremental_output": True})
+        text = ""
+        with self._post_json('dashscope', VL_PATH, data, headers, attachment, handle=handle, share=0.6,
+                             timeout=35) as resp:
+            if resp.status_code != 200:
+                return None
+            with self.metrics.span('receive', 'dashscope') as span:
+                for event in iter_sse(resp):
+                    if handle:
+                        handle.check()
+                    choices = event.get('output', {}).get('choices') or []
+                    if not choices:
+                        continue
+                    for item in choices[0].get('message', {}).get('content') or []:
+                        text += item.get('text', '')
+                    on_text(text)
+                span.bytes = resp.raw.tell()
+        return text or None
+
+    def _post_json(self, provider, path, data, headers, attachment=None, **kwargs):
+        # 以请求体最后一个字节发出的时刻把耗时拆分为 upload 和 model 两段；返回的响应尚未读取响应体。
+        # attachment 为 (fileobj, size, mime) 时替换 data 中的 DATA_URL，图片编码计入 upload
+        with self.metrics.span('encode', provider) as span:
+            body = json_body(data, *(attachment or ()))
+            span.bytes = len(body)
+        headers = dict(headers, **{"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            resp = self.clients[provider].post(path, data=body, stream=True, headers=headers, **kwargs)
+        except Exception as e:
+            outcome = 'cancelled' if isinstance(e, Cancelled) else 'error'
+            now = time.perf_counter()
+            if body.sent_at is None:
+                self.metrics.record('upload', (now - start) * 1000, provider, len(body), outcome)
+            else:
+                self.metrics.record('upload', (body.sent_at - start) * 1000, provider, len(body))
+                self.metrics.record('model', (now - body.sent_at) * 1000, provider, None, outcome)
+            raise
+        received = time.perf_counter()
+        sent = body.sent_at or received
+        self.metrics.record('upload', (sent - start) * 1000, provider, len(body))
+        self.metrics.record('model', (received - sent) * 1000, provider, None,
+                            'ok' if resp.status_code == 200 else f'http_{resp.status_code}')
+        return resp
+
+    def _receive(self, resp, provider):
+        with self.metrics.span('receive', provider) as span:
+            content = resp.content
+            span.bytes = len(content)
+        return content
+
+    def _call_aliyun_ocr(self, path, ak, sk):
+        # 简化版，推荐使用 VL
+        return None
+
+    def _format_cached(self, text, ds_key, on_progress=None, handle=None):
+        if not ds_key:
+            return self._format_ai_result(text, ds_key)
+
+        text_key = self.hash_text(text)
+        cached = self.cache_get('result_cache', text_key)
+        if cached:
+            try:
+                return json.loads(cached)
+            except ValueError:
+                pass
+
+        on_fields = None
+        if on_progress:
+            on_fields = lambda fields: on_progress('format', fields)
+        result = self._format_ai_result(text, ds_key, on_fields, handle)
+        if not self.format_failed(result):
+            self.cache_put('result_cache', text_key, json.dumps(result, ensure_ascii=False))
+        return result
+
+    def _format_ai_result(self, text, ds_key, on_fields=None, handle=None):
+        if not ds_key:
+            return {"title": "识别结果", "core_conclusion": text[:100], "abnormal_analysis": text}
+
+        if self.map_reduce:
+            full_text, full_stats = compact_text(text, None)
+            if full_stats['tokens_out'] > self.prompt_budget:
+                text = self._map_sections(full_text, ds_key, handle)
+
+        content_text, stats = compact_text(text, self.prompt_budget)
+        print(f"[PROMPT] {stats['tokens_in']} -> {stats['tokens_out']} tokens "
+              f"({stats['chars_in']} -> {stats['chars_out']} chars, dropped {stats['dropped_lines']} lines)")
+        prompt = f"""
+        你是一位医生。根据内容生成JSON。
+        内容：{content_text}
+        格式：{{"title":"标题","core_conclusion":"结论","abnormal_analysis":"异常","life_advice":"建议",
+        "lab_items":[{{"name":"项目","value":"数值","unit":"单位","range":"参考范围","flag":"↑/↓/空"}}]}}
+        纯JSON，无Markdown。
+        """
+        body = {"model": "deepseek-chat", "messages": [{"role": "user", "content": prompt}],
+                "response_format": {"type": "json_object"}}
+        try:
+            if on_fields:
+                content = self._stream_deepseek(body, ds_key, on_fields, handle)
+            else:
+                with self._post_json('deepseek', CHAT_PATH, body, {"Authorization": f"Bearer {ds_key}"},
+                                     handle=handle, timeout=20) as resp:
+                    raw = self._receive(resp, 'deepseek')
+            with self.metrics.span('parse', 'deepseek'):
+                if not on_fields:
+                    content = json.loads(raw)['choices'][0]['message']['content']
+                content = content.replace("```json", "").replace("```", "").strip()
+                return json.loads(content)
+        except Cancelled:
+            raise
+        except:
+            if handle:
+                handle.check()
+            return {"title": "解析完成", "core_conclusion": FORMAT_FAILED, "abnormal_analysis": text}
+
+    def _map_sections(self, text, ds_key, handle=None):
+        # map 阶段：各段并发摘要，失败的段保留原文，按原顺序拼接供 reduce 阶段整理
+        sections = split_sections(text, self.prompt_budget)
+        start = time.perf_counter()
+        summaries = list(sections)
+        with ThreadPoolExecutor(max_workers=max(1, min(MAP_WORKERS, len(sections)))) as pool:
+            futures = {pool.submit(self._summarize_section, sec, ds_key, handle): i
+                       for i, sec in enumerate(sections)}
+            for fut in as_completed(futures):
+                try:
+                    summary = fut.result()
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    print(f"Map Error: {e}")
+                    summary = None
+                if summary:
+                    summaries[futures[fut]] = summary
+        print(f"[MAP] {len(sections)} sections summarized in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return "\n\n".join(summaries)
+
+    def _summarize_section(self, section, ds_key, handle=None):
+        prompt = f"""
+        以下是一份医疗报告的一部分。逐条列出其中的检验项目（名称、数值、单位、参考范围、是否异常）和诊断意见，
+        保留原始数值，不要解读，不要遗漏异常项。
+        内容：{section}
+        """
+        # map 阶段各段并发，每段最多占用剩余预算的一半，保证 reduce 阶段仍有时间
+        with self._post_json('deepseek', CHAT_PATH,
+                             {"model": "deepseek-chat", "messages": [{"role": "user", "content": prompt}]},
+                             {"Authorization": f"Bearer {ds_key}"}, handle=handle, share=0.5, timeout=20) as resp:
+            raw = self._receive(resp, 'deepseek')
+        with self.metrics.span('parse', 'deepseek'):
+            return json.loads(raw)['choices'][0]['message']['content'].strip()
+
+    def _stream_deepseek(self, body, ds_key, on_fields, handle=None):
+        content = ""
+        with self._post_json('deepseek', CHAT_PATH, dict(body, stream=True), {"Authorization": f"Bearer {ds_key}"},
+                             handle=handle, timeout=20) as resp:
+            resp.raise_for_status()
+            with self.metrics.span('receive', 'deepseek') as span:
+                for event in iter_sse(resp):
+                    if handle:
+                        handle.check()
+                    choices = event.get('choices') or []
+                    if not choices:
+                        continue
+                    delta = choices[0].get('delta', {}).get('content')
+                    if delta:
+                        content += delta
+                        fields = parse_partial_fields(content)
+                        if fields:
+                            on_fields(fields)
+                span.bytes = resp.raw.tell()
+        return content
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+from imaging import compact_image
+
+# 缓存目录中图片副本的总大小上限
+IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+# 读入的原图不超过此大小时留在内存中，否则暂存到临时文件
+SPOOL_BYTES = 16 * 1024 * 1024
+IO_CHUNK = 256 * 1024
+
+_NAME = re.compile(r'^img_([0-9a-f]{64})\.jpg$')
+
+
+class ImageCache:
+    """拍照和相册图片的副本目录，文件以原图内容的 sha256 命名。
+
+    ingest() 只读取一遍来源数据，同时计算哈希并缩小保存，相同内容重复导入时直接复用已有文件；
+    文件名中的哈希即识别缓存的键，分析时无需再次读取整张图片。
+    总大小超过 max_bytes 时按最近使用时间（mtime）从旧到新删除。
+    """
+
+    def __init__(self, directory, max_bytes=IMAGE_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"img_{key}.jpg")
+
+    @staticmethod
+    def key_for(path):
+        # 非本目录生成的文件返回 None，调用方自行计算哈希
+        m = _NAME.match(os.path.basename(str(path)))
+        return m.group(1) if m else None
+
+    def ingest(self, stream):
+        h = hashlib.sha256()
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, dir=self.directory) as spool:
+            for chunk in iter(lambda: stream.read(IO_CHUNK), b''):
+                h.update(chunk)
+                spool.write(chunk)
+
+            path = self.path_for(h.hexdigest())
+            if os.path.exists(path):
+                self.touch(path)
+                return path
+
+            part = path + '.part'
+            spool.seek(0)
+            if compact_image(spool, part) is None:
+                spool.seek(0)
+                with open(part, 'wb') as f:
+                    shutil.copyfileobj(spool, f, IO_CHUNK)
+            os.replace(part, path)
+        return path
+
+    def ingest_file(self, src_path):
+        # 相机应用直接写入的原图导入后删除
+        with open(src_path, 'rb') as f:
+            path = self.ingest(f)
+        os.remove(src_path)
+        return path
+
+    @staticmethod
+    def touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def entries(self):
+        result = []
+        for name in os.listdir(self.directory):
+            if not _NAME.match(name):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            result.append((st.st_mtime, st.st_size, path))
+        return result
+
+    def usage(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=()):
+        # keep 中的文件（刚导入或仍在任务队列中的图片）不删除
+        keep = {os.path.abspath(p) for p in keep}
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        return removed
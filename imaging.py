@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import time
+
+# PIL 与 numpy 在首次处理图片时才导入，见 load_modules()
+Image = None
+ImageOps = None
+np = None
+_modules_loaded = False
+
+# 默认预处理参数：长边 1600px 对报告文字足够清晰，灰度 JPEG 体积约为原图 1/10
+DEFAULT_IMAGE_OPTIONS = {
+    'max_edge': 1600,
+    'format': 'JPEG',
+    'quality': 75,
+    'grayscale': True,
+    # 纸张检测、透视校正与去倾斜（需要 numpy）
+    'detect_document': True,
+    'deskew': True,
+    # 拍摄质量门限：拉普拉斯方差（清晰度）与 5%~95% 灰度跨度（对比度）
+    'min_sharpness': 40.0,
+    'min_contrast': 40.0,
+}
+
+# 质量检测与纸张检测使用的缩略图尺寸
+ANALYSIS_EDGE = 512
+
+# 导入图片时保存的副本：长边和质量都高于上传参数，保留质量检测与纸张检测所需的细节
+INGEST_EDGE = 2400
+INGEST_QUALITY = 88
+# 历史归档中附带的缩略图尺寸
+THUMB_EDGE = 256
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+
+def load_modules():
+    # 可选依赖缺失时保持为 None，各函数退化为不处理
+    global Image, ImageOps, np, _modules_loaded
+    if _modules_loaded:
+        return
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        pass
+    try:
+        import numpy as np
+    except ImportError:
+        pass
+    _modules_loaded = True
+
+
+def _to_array(img, edge=ANALYSIS_EDGE):
+    small = img.convert('L')
+    if max(small.size) > edge:
+        small = small.copy()
+        small.thumbnail((edge, edge), Image.BILINEAR)
+    return np.asarray(small, dtype=np.float32)
+
+
+def compact_image(src, dest, max_edge=INGEST_EDGE, quality=INGEST_QUALITY):
+    """把 src（路径或文件对象）按 EXIF 方向转正、缩小到 max_edge 后以 JPEG 写入 dest。
+
+    返回 (width, height)；缺少 PIL 或无法解码时返回 None，由调用方改为保存原始数据。
+    """
+    load_modules()
+    if Image is None:
+        return None
+    try:
+        with Image.open(src) as img:
+            if img.format == 'JPEG':
+                img.draft('RGB', (max_edge, max_edge))
+            img = ImageOps.exif_transpose(img)
+            if max(img.size) > max_edge:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            img.save(dest, 'JPEG', quality=quality)
+            return img.size
+    except Exception as e:
+        print(f"Image Compact Error: {e}")
+        return None
+
+
+def make_thumbnail(path, edge=THUMB_EDGE, quality=70):
+    """生成 JPEG 缩略图并返回 bytes，缺少 PIL 或无法解码时返回 None。"""
+    load_modules()
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            if img.format == 'JPEG':
+                img.draft('RGB', (edge, edge))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((edge, edge), Image.BILINEAR)
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            buf = io.BytesIO()
+            img.save(buf, 'JPEG', quality=quality)
+            return buf.getvalue()
+    except Exception as e:
+        print(f"Thumbnail Error: {e}")
+        return None
+
+
+def assess_quality(path, options=None):
+    """快速判断照片是否模糊或对比度过低，返回 (ok, reason, metrics)。"""
+    opts = dict(DEFAULT_IMAGE_OPTIONS)
+    if options:
+        opts.update(options)
+    load_modules()
+    if Image is None or np is None:
+        return True, None, {}
+
+    start = time.perf_counter()
+    try:
+        with Image.open(path) as img:
+            # 只按 1/4~1/8 比例解码，整个检测在毫秒级完成
+            img.draft('L', (ANALYSIS_EDGE * 2, ANALYSIS_EDGE * 2))
+            a = _to_array(img, ANALYSIS_EDGE * 2)
+    except Exception as e:
+        print(f"Quality Check Error: {e}")
+        return True, None, {}
+
+    lap = (a[:-2, 1:-1] + a[2:, 1:-1] + a[1:-1, :-2] + a[1:-1, 2:] - 4 * a[1:-1, 1:-1])
+    lo, hi = np.percentile(a, (5, 95))
+    metrics = {
+        'sharpness': float(lap.var()),
+        'contrast': float(hi - lo),
+        'ms': (time.perf_counter() - start) * 1000,
+    }
+
+    if metrics['contrast'] < opts['min_contrast']:
+        return False, 'low_contrast', metrics
+    if metrics['sharpness'] < opts['min_sharpness']:
+        return False, 'blurry', metrics
+    return True, None, metrics
+
+
+def _otsu(a):
+    hist = np.bincount(a.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    prob = hist / hist.sum()
+    omega = np.cumsum(prob)
+    mu = np.cumsum(prob * np.arange(256))
+    denom = omega * (1 - omega)
+    denom[denom == 0] = np.nan
+    between = (mu[-1] * omega - mu) ** 2 / denom
+    return int(np.nanargmax(between))
+
+
+def find_document_quad(a):
+    """在灰度缩略图中寻找纸张四角，返回 [tl, tr, br, bl]，找不到时返回 None。"""
+    mask = a > _otsu(a)
+    coverage = mask.mean()
+    # 整幅都是纸或几乎没有亮区时不做裁剪
+    if coverage < 0.2 or coverage > 0.97:
+        return None
+
+    rows = np.flatnonzero(mask.mean(axis=1) > 0.3)
+    cols = np.flatnonzero(mask.mean(axis=0) > 0.3)
+    if len(rows) < 2 or len(cols) < 2:
+        return None
+    sub = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    ys, xs = np.nonzero(sub)
+    xs = xs + cols[0]
+    ys = ys + rows[0]
+
+    s = xs + ys
+    d = xs - ys
+    quad = np.array([
+        (xs[s.argmin()], ys[s.argmin()]),
+        (xs[d.argmax()], ys[d.argmax()]),
+        (xs[s.argmax()], ys[s.argmax()]),
+        (xs[d.argmin()], ys[d.argmin()]),
+    ], dtype=np.float64)
+
+    # 鞋带公式求面积，过小说明检测不可靠
+    x, y = quad[:, 0], quad[:, 1]
+    area = 0.5 * abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
+    if area < 0.25 * a.shape[0] * a.shape[1]:
+        return None
+    return quad
+
+
+def _perspective_coeffs(dst, src):
+    # 求解 PIL PERSPECTIVE 变换的 8 个系数：输出坐标 dst -> 输入坐标 src
+    rows = []
+    rhs = []
+    for (x, y), (u, v) in zip(dst, src):
+        rows.append([x, y, 1, 0, 0, 0, -u * x, -u * y])
+        rows.append([0, 0, 0, x, y, 1, -v * x, -v * y])
+        rhs.extend([u, v])
+    return np.linalg.solve(np.array(rows, dtype=np.float64), np.array(rhs, dtype=np.float64)).tolist()
+
+
+def warp_document(img, quad):
+    tl, tr, br, bl = quad
+    width = int(max(np.hypot(*(tr - tl)), np.hypot(*(br - bl))))
+    height = int(max(np.hypot(*(bl - tl)), np.hypot(*(br - tr))))
+    if width < 32 or height < 32:
+        return img
+    dst = [(0, 0), (width, 0), (width, height), (0, height)]
+    coeffs = _perspective_coeffs(dst, quad)
+    return img.transform((width, height), Image.PERSPECTIVE, coeffs, Image.BICUBIC)
+
+
+def estimate_skew(a, max_angle=5.0, step=0.25):
+    """按文字行投影方差估计倾斜角（度），所有候选角度一次性向量化计算。"""
+    ink = a < _otsu(a)
+    ys, xs = np.nonzero(ink)
+    if len(xs) < 50:
+        return 0.0
+    if len(xs) > 40000:
+        pick = np.random.default_rng(0).choice(len(xs), 40000, replace=False)
+        xs, ys = xs[pick], ys[pick]
+
+    angles = np.arange(-max_angle, max_angle + step / 2, step)
+    tans = np.tan(np.radians(angles))
+    # 每个候选角度下墨迹点的投影行号，矩阵形状 (角度数, 点数)
+    proj = np.rint(ys[None, :] - xs[None, :] * tans[:, None]).astype(np.int64)
+    proj -= proj.min()
+    width = int(proj.max()) + 1
+    offsets = np.arange(len(angles))[:, None] * width
+    hist = np.bincount((proj + offsets).ravel(), minlength=width * len(angles)).reshape(len(angles), width)
+    return float(angles[hist.var(axis=1).argmax()])
+
+
+def trim_margins(img, a, pad=0.02):
+    # 按墨迹的行列投影裁掉四周空白
+    ink = a < _otsu(a)
+    rows = np.flatnonzero(ink.mean(axis=1) > 0.002)
+    cols = np.flatnonzero(ink.mean(axis=0) > 0.002)
+    if len(rows) < 2 or len(cols) < 2:
+        return img
+    h, w = a.shape
+    sx, sy = img.size[0] / w, img.size[1] / h
+    py, px = int(h * pad), int(w * pad)
+    box = (
+        int(max(0, cols[0] - px) * sx), int(max(0, rows[0] - py) * sy),
+        int(min(w, cols[-1] + 1 + px) * sx), int(min(h, rows[-1] + 1 + py) * sy),
+    )
+    if (box[2] - box[0]) * (box[3] - box[1]) < 0.2 * img.size[0] * img.size[1]:
+        return img
+    return img.crop(box)
+
+
+def normalize_document(img, opts):
+    """纸张检测 + 透视校正 + 去倾斜 + 裁边，返回 (图片, 执行过的步骤)。"""
+    steps = []
+    load_modules()
+    if np is None:
+        return img, steps
+
+    if opts.get('detect_document'):
+        a = _to_array(img)
+        quad = find_document_quad(a)
+        if quad is not None:
+            scale = max(img.size) / max(a.shape)
+            img = warp_document(img, quad * scale)
+            steps.append('warp')
+
+    if opts.get('deskew'):
+        a = _to_array(img)
+        angle = estimate_skew(a)
+        if abs(angle) >= 0.5:
+            # 投影 y - x*tan(a) 拉直文字行时，图像需按同一角度旋转回正
+            fill = 255 if img.mode == 'L' else (255, 255, 255)
+            img = img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=fill)
+            steps.append(f'deskew({angle:+.2f})')
+        a = _to_array(img)
+        img = trim_margins(img, a)
+        steps.append('trim')
+    return img, steps
+
+
+def preprocess_image(path, options=None):
+    """读取图片并压缩为适合上传的格式，返回 (bytes, mime, stats)。"""
+    image, mime, stats = open_preprocessed(path, options)
+    with image:
+        return image.read(), mime, stats
+
+
+def open_preprocessed(path, options=None):
+    """压缩图片并返回 (fileobj, mime, stats)，fileobj 位于开头，由调用方关闭。
+
+    压缩后的数据保留在 BytesIO 中；不处理或压缩无收益时直接返回打开的原图文件，
+    上传时分块读取，原图不会整体读入内存。stats['out_bytes'] 为 fileobj 的长度。
+    """
+    opts = dict(DEFAULT_IMAGE_OPTIONS)
+    if options:
+        opts.update(options)
+
+    load_modules()
+    start = time.perf_counter()
+    src_bytes = os.path.getsize(path)
+    stats = {'src_bytes': src_bytes, 'out_bytes': src_bytes, 'saved_bytes': 0,
+             'ms': 0.0, 'size': None, 'processed': False, 'steps': []}
+
+    if Image is None:
+        stats['ms'] = (time.perf_counter() - start) * 1000
+        return open(path, 'rb'), 'image/jpeg', stats
+
+    try:
+        fmt = str(opts['format']).upper()
+        if fmt == 'JPG':
+            fmt = 'JPEG'
+        max_edge = int(opts['max_edge'])
+
+        with Image.open(path) as img:
+            # JPEG 可在解码阶段按 DCT 缩放，避免完整解码 12MP 原图
+            if img.format == 'JPEG' and max_edge > 0:
+                img.draft('L' if opts['grayscale'] else 'RGB', (max_edge, max_edge))
+            img = ImageOps.exif_transpose(img)
+
+            if max_edge > 0 and max(img.size) > max_edge:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            if opts['grayscale']:
+                img = img.convert('L')
+            elif img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+
+            img, steps = normalize_document(img, opts)
+            stats['steps'] = steps
+
+            buf = io.BytesIO()
+            save_kwargs = {'quality': int(opts['quality'])}
+            if fmt == 'JPEG':
+                save_kwargs['optimize'] = True
+            elif fmt == 'WEBP':
+                save_kwargs['method'] = 4
+            img.save(buf, fmt, **save_kwargs)
+            size = img.size
+
+        out_bytes = buf.tell()
+        buf.seek(0)
+        image = buf
+        mime = MIME_TYPES.get(fmt, 'image/jpeg')
+
+        # 原图已经足够小时直接上传原图
+        if out_bytes >= src_bytes:
+            image = open(path, 'rb')
+            out_bytes = src_bytes
+            mime = 'image/jpeg'
+        else:
+            stats['processed'] = True
+
+        stats.update(out_bytes=out_bytes, saved_bytes=src_bytes - out_bytes, size=size)
+    except Exception as e:
+        print(f"Image Preprocess Error: {e}")
+        image = open(path, 'rb')
+        mime = 'image/jpeg'
+        stats['out_bytes'] = src_bytes
+
+    stats['ms'] = (time.perf_counter() - start) * 1000
+    return image, mime, stats
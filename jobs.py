@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+
+from providers import AnalysisHandle, Cancelled, DeadlineExceeded
+
+# 任务状态：pending -> extracting -> formatting -> done / failed / cancelled
+PENDING = 'pending'
+EXTRACTING = 'extracting'
+FORMATTING = 'formatting'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+ACTIVE_STATES = (PENDING, EXTRACTING, FORMATTING)
+
+MAX_ATTEMPTS = 4
+RETRY_BASE = 5.0
+RETRY_MAX = 120.0
+# 已结束任务在表中保留的时间
+FINISHED_TTL = 7 * 24 * 3600
+
+
+class JobQueue:
+    """SQLite 持久化的分析任务队列，由单个后台线程按顺序处理。
+
+    识别出的文字在进入整理阶段前落库，应用被杀或断网后下次启动从断点继续。
+    监听函数 listener(job_id, event, payload) 在工作线程中回调，event 为 'progress'、'retry'、
+    'done'、'failed' 或 'cancelled'；提交时指定的监听函数优先，其余任务（如启动时恢复的任务）使用全局 listener。
+    每次尝试使用一个 AnalysisHandle，超出截止时间直接失败不再重试，cancel() 会立即中断正在进行的请求。
+    """
+
+    def __init__(self, backend, keys_provider):
+        self.backend = backend
+        self.db = backend.db
+        self.keys_provider = keys_provider
+        self.listener = None
+        self._listeners = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._cancelled = set()
+        self._current = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='analysis-worker', daemon=True)
+        self._thread.start()
+
+    def submit(self, image_paths, listener=None):
+        # 不等待写线程（其前面可能排着维护等写操作），返回 Future，结果为任务 id，可在界面线程直接调用。
+        # 监听函数在插入时登记，早于事务提交，工作线程取到任务时一定已就绪
+        now = time.time()
+        paths = json.dumps(list(image_paths))
+
+        def insert(conn):
+            job_id = conn.execute(
+                'INSERT INTO jobs (state, image_paths, created_at, updated_at) VALUES (?, ?, ?, ?)',
+                (PENDING, paths, now, now)
+            ).lastrowid
+            if listener:
+                self._listeners[job_id] = listener
+            return job_id
+
+        fut = self.db.submit(insert)
+        fut.add_done_callback(lambda f: self._wake.set())
+        return fut
+
+    def cancel(self, job_id):
+        with self._lock:
+            self._cancelled.add(job_id)
+            current = self._current
+        if current and current[0] == job_id:
+            current[1].cancel()
+        self._wake.set()
+
+    def pending_count(self):
+        row = self.db.query_one(
+            f'SELECT COUNT(*) FROM jobs WHERE state IN ({",".join("?" * len(ACTIVE_STATES))})', ACTIVE_STATES)
+        return row[0] if row else 0
+
+    def active_paths(self):
+        # 未完成任务引用的图片，清理缓存目录时需保留
+        rows = self.db.query(
+            f'SELECT image_paths FROM jobs WHERE state IN ({",".join("?" * len(ACTIVE_STATES))})', ACTIVE_STATES)
+        return [p for row in rows for p in json.loads(row[0])]
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        cols = ', '.join(f'{k} = ?' for k in fields)
+        # 同步等待提交，保证工作线程下一次读取时看到最新状态
+        self.db.execute(f'UPDATE jobs SET {cols} WHERE id = ?', list(fields.values()) + [job_id]).result()
+
+    def _notify(self, job_id, event, payload):
+        listener = self._listeners.get(job_id, self.listener)
+        if event in FINISHED_STATES:
+            self._listeners.pop(job_id, None)
+        if listener:
+            try:
+                listener(job_id, event, payload)
+            except Exception as e:
+                print(f"Job Listener Error: {e}")
+
+    def _next_job(self):
+        return self.db.query_one(f'''
+            SELECT id, state, image_paths, ocr_text, attempts, next_attempt_at FROM jobs
+            WHERE state IN ({",".join("?" * len(ACTIVE_STATES))})
+            ORDER BY next_attempt_at, id LIMIT 1
+        ''', ACTIVE_STATES)
+
+    def _drain_cancelled(self):
+        # 处理排队中或退避等待中被取消的任务
+        with self._lock:
+            job_ids, self._cancelled = self._cancelled, set()
+        for job_id in job_ids:
+            row = self.db.query_one('SELECT state FROM jobs WHERE id = ?', (job_id,))
+            if row and row[0] in ACTIVE_STATES:
+                self._finish(job_id, CANCELLED, self.backend.cancelled_result())
+
+    def _run(self):
+        self.db.execute(f'DELETE FROM jobs WHERE state IN ({",".join("?" * len(FINISHED_STATES))}) AND updated_at < ?',
+                        FINISHED_STATES + (time.time() - FINISHED_TTL,))
+        while True:
+            self._drain_cancelled()
+            job = self._next_job()
+            if job is None:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            delay = job[5] - time.time()
+            if delay > 0:
+                # 等待退避时间，期间有新任务提交时提前唤醒
+                self._wake.wait(delay)
+                self._wake.clear()
+                continue
+            try:
+                self._process(*job[:5])
+            except DeadlineExceeded:
+                print(f"[JOB] {job[0]} deadline exceeded")
+                self._finish(job[0], FAILED, self.backend.timeout_result(), error='deadline')
+            except Cancelled:
+                self._finish(job[0], CANCELLED, self.backend.cancelled_result())
+            except Exception as e:
+                print(f"Job Error: {e}")
+                self._retry(job[0], job[1], job[4], str(e))
+            finally:
+                with self._lock:
+                    self._current = None
+
+    def _process(self, job_id, state, image_paths, ocr_text, attempts):
+        handle = AnalysisHandle(self.backend.deadline)
+        with self._lock:
+            self._current = (job_id, handle)
+            if job_id in self._cancelled:
+                handle.cancel()
+        handle.check()
+        keys = self.keys_provider()
+        paths = json.loads(image_paths)
+        on_progress = lambda stage, fields: self._notify(job_id, 'progress', (stage, fields))
+
+        if ocr_text is None:
+            rejected = self.backend.precheck(paths, keys)
+            if rejected:
+                self._finish(job_id, FAILED, rejected, error='precheck')
+                return
+            self._update(job_id, state=EXTRACTING)
+            ocr_text = self.backend.extract_pages(paths, keys, on_progress, handle=handle)
+            if not ocr_text:
+                self._retry(job_id, PENDING, attempts, 'extract', self.backend.failed_result())
+                return
+            # 检查点：识别文字落库后，即使整理失败也不必重新上传图片
+            self._update(job_id, state=FORMATTING, ocr_text=ocr_text)
+
+        result = self.backend.format_text(ocr_text, keys, on_progress, handle)
+        if self.backend.format_failed(result) and attempts + 1 < MAX_ATTEMPTS:
+            self._retry(job_id, FORMATTING, attempts, 'format', result)
+            return
+
+        saved = self.backend.save_record(result)
+        record_id = saved.result() if saved else None
+        self._finish(job_id, DONE, result, record_id=record_id)
+
+    def _retry(self, job_id, state, attempts, error, fallback=None):
+        attempts += 1
+        if attempts >= MAX_ATTEMPTS:
+            self._finish(job_id, FAILED, fallback or self.backend.failed_result(), error=error, attempts=attempts)
+            return
+        delay = min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1))
+        print(f"[JOB] {job_id} {error} failed, retry #{attempts} in {delay:.0f}s")
+        self._update(job_id, state=state, attempts=attempts, next_attempt_at=time.time() + delay, error=error)
+        self._notify(job_id, 'retry', {'attempts': attempts, 'delay': delay})
+
+    def _finish(self, job_id, state, result, **fields):
+        self._update(job_id, state=state, result_json=json.dumps(result, ensure_ascii=False), **fields)
+        self._notify(job_id, state, result)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import re
+
+# 常见检验项目别名，统一到英文缩写便于跨报告比较
+ALIASES = {
+    'ALT': ('谷丙转氨酶', '丙氨酸氨基转移酶', '丙氨酸转氨酶'),
+    'AST': ('谷草转氨酶', '天门冬氨酸氨基转移酶', '天冬氨酸转氨酶'),
+    'GLU': ('葡萄糖', '血糖', '空腹血糖', '空腹血葡萄糖'),
+    'HBA1C': ('糖化血红蛋白',),
+    'TC': ('总胆固醇', '胆固醇'),
+    'TG': ('甘油三酯', '三酰甘油'),
+    'HDL-C': ('高密度脂蛋白胆固醇', '高密度脂蛋白'),
+    'LDL-C': ('低密度脂蛋白胆固醇', '低密度脂蛋白'),
+    'WBC': ('白细胞', '白细胞计数'),
+    'RBC': ('红细胞', '红细胞计数'),
+    'HGB': ('血红蛋白',),
+    'PLT': ('血小板', '血小板计数'),
+    'CREA': ('肌酐', '血肌酐'),
+    'UA': ('尿酸', '血尿酸'),
+    'BUN': ('尿素氮', '尿素'),
+    'TBIL': ('总胆红素',),
+}
+_ALIAS_INDEX = {name: key for key, names in ALIASES.items() for name in names}
+
+_NUM = r'\d+(?:\.\d+)?'
+_ABBR = re.compile(r'[（(]\s*([A-Za-z][A-Za-z0-9\-]{0,9})\s*[)）]')
+_RANGE = re.compile(rf'({_NUM})\s*[-~～—–]+\s*({_NUM})')
+_BOUND = re.compile(rf'([<＜≤>＞≥])\s*=?\s*({_NUM})')
+
+# 文本中的一条检验结果：名称 [：] 数值 [单位] [参考值] 范围 [箭头]
+_LINE = re.compile(
+    rf'(?P<name>[一-龥A-Za-z][一-龥A-Za-z0-9()（）\-]{{0,20}}?)\s*[:：]?\s*'
+    rf'(?P<value>{_NUM})\s*(?P<unit>[A-Za-zμµ%/^*×0-9]+(?:/[A-Za-z]+)?)?\s*'
+    rf'[（(]?\s*(?:参考(?:值|范围)?|正常值)?\s*[:：]?\s*'
+    rf'(?P<low>{_NUM})\s*[-~～—–]+\s*(?P<high>{_NUM})\s*[)）]?\s*(?P<flag>[↑↓]|偏高|偏低)?'
+)
+
+
+def test_key(name):
+    name = str(name).strip()
+    m = _ABBR.search(name)
+    if m:
+        return m.group(1).upper()
+    base = re.sub(r'[（(].*?[)）]', '', name).strip()
+    if base.upper() in ALIASES:
+        return base.upper()
+    return _ALIAS_INDEX.get(base, base)
+
+
+def _to_float(value):
+    try:
+        return float(str(value).strip())
+    except (TypeError, ValueError):
+        m = re.search(_NUM, str(value or ''))
+        return float(m.group(0)) if m else None
+
+
+def _flag(raw, value, low, high):
+    raw = str(raw or '').strip()
+    if raw in ('↑', 'H', '高', '偏高'):
+        return 'H'
+    if raw in ('↓', 'L', '低', '偏低'):
+        return 'L'
+    if value is not None:
+        if high is not None and value > high:
+            return 'H'
+        if low is not None and value < low:
+            return 'L'
+    return 'N'
+
+
+def normalize_item(name, value, unit=None, ref=None, flag=None):
+    num = _to_float(value)
+    if not name or num is None:
+        return None
+    low = high = None
+    ref_text = str(ref or '')
+    m = _RANGE.search(ref_text)
+    if m:
+        low, high = float(m.group(1)), float(m.group(2))
+    else:
+        # 单侧参考值，如 "<5.2"、"≥1.0"
+        m = _BOUND.search(ref_text)
+        if m and m.group(1) in '<＜≤':
+            high = float(m.group(2))
+        elif m:
+            low = float(m.group(2))
+    return {
+        'test_key': test_key(name),
+        'test_name': str(name).strip(),
+        'value': num,
+        'value_text': str(value).strip(),
+        'unit': str(unit or '').strip(),
+        'ref_low': low,
+        'ref_high': high,
+        'ref_text': str(ref or '').strip(),
+        'flag': _flag(flag, num, low, high),
+    }
+
+
+def parse_text(text):
+    items = []
+    for m in _LINE.finditer(text or ''):
+        item = normalize_item(m.group('name'), m.group('value'), m.group('unit'),
+                              f"{m.group('low')}-{m.group('high')}", m.group('flag'))
+        if item:
+            items.append(item)
+    return items
+
+
+def extract_lab_items(result_data):
+    """从分析结果中提取规范化的检验项目列表。"""
+    items = []
+    for raw in result_data.get('lab_items') or []:
+        if not isinstance(raw, dict):
+            continue
+        try:
+            item = normalize_item(raw.get('name'), raw.get('value'), raw.get('unit'),
+                                  raw.get('range'), raw.get('flag'))
+        except Exception as e:
+            # 模型偶尔返回格式异常的字段，只跳过这一项，不影响整条记录保存
+            print(f"Lab Item Error: {e} {raw!r:.200}")
+            continue
+        if item:
+            items.append(item)
+
+    # 模型未返回结构化结果（如旧记录）时从文字中解析
+    if not items:
+        for field in ('abnormal_analysis', 'core_conclusion'):
+            value = result_data.get(field)
+            if value:
+                items.extend(parse_text(value if isinstance(value, str) else str(value)))
+
+    seen = set()
+    unique = []
+    for item in items:
+        if item['test_key'] not in seen:
+            seen.add(item['test_key'])
+            unique.append(item)
+    return unique
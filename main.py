@@ -1,25 +1,46 @@
 # -*- coding: utf-8 -*-
+import time
+
+# 冷启动计时起点，尽量早于其他导入
+STARTUP_T0 = time.perf_counter()
+
 import os
-import threading
-import json
 import configparser
 import shutil
+import threading
+from datetime import datetime
 from kivy.lang import Builder
 from kivy.clock import Clock, mainthread
 from kivy.core.window import Window
-from kivy.metrics import dp
+from kivy.metrics import dp, sp
 from kivy.core.text import LabelBase
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.uix.screenmanager import ScreenManager
 from kivy.properties import StringProperty, ColorProperty, ListProperty
+from kivy.utils import escape_markup, get_color_from_hex
 
 from kivymd.app import MDApp
 from kivymd.uix.screen import MDScreen
 from kivymd.uix.card import MDCard
-from kivymd.uix.dialog import MDDialog
+from kivymd.uix.label import MDLabel
 from kivymd.toast import toast
 
 # 引入后端逻辑
 from backend import BackendService
+from core import HISTORY_PAGE_SIZE, HIT_START, HIT_END
+from resultrows import build_rows
+
+# 启动时间点 [(名称, 距计时起点毫秒数)]，后端就绪后写入 metrics 表
+STARTUP_MARKS = []
+
+
+def mark_startup(name):
+    ms = (time.perf_counter() - STARTUP_T0) * 1000
+    print(f"[STARTUP] {name} at {ms:.0f} ms")
+    STARTUP_MARKS.append((name, ms))
+
+
+mark_startup('imports')
 
 # 注册中文字体
 font_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'msyh.ttf')
@@ -34,6 +55,36 @@ class HomeCard(MDCard):
     icon_color = ColorProperty([0, 0, 0, 1])
 
 
+# 结果页各部分：(字段, 标题, 标题颜色)
+RESULT_SECTIONS = (
+    ('core_conclusion', "核心结论", '#D32F2F'),
+    ('abnormal_analysis', "异常分析", '#F57C00'),
+    ('life_advice', "生活建议", '#388E3C'),
+)
+# 结果页相邻两行的间距
+RESULT_ROW_GAP = 12
+
+
+class ResultRow(RecycleDataViewBehavior, MDLabel):
+    # 结果页的一行（一个段落），只有可见行会创建纹理
+    index = None
+    rv = None
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.rv = rv
+        self.index = index
+        return super().refresh_view_attrs(rv, index, data)
+
+    def on_texture_size(self, instance, size):
+        # 后台按字数估算的高度与实际排版不一致时回写，RecycleView 随之重新布局
+        if self.rv is None or self.index is None or self.index >= len(self.rv.data):
+            return
+        height = size[1] + dp(RESULT_ROW_GAP)
+        item = self.rv.data[self.index]
+        if abs(item.get('height', 0) - height) > 1:
+            self.rv.data[self.index] = dict(item, height=height)
+
+
 KV = '''
 #:import hex kivy.utils.get_color_from_hex
 
@@ -94,6 +145,12 @@ KV = '''
                 icon_color: hex('#2E7D32')
                 on_release: app.action_camera()
 
+            HomeCard:
+                icon: "camera-burst"
+                text: "多页拍摄"
+                icon_color: hex('#6A1B9A')
+                on_release: app.action_camera_batch()
+
             HomeCard:
                 icon: "image"
                 text: "相册选择"
@@ -107,6 +164,12 @@ KV = '''
                 on_release: app.switch_to('history')
 
         Widget:
+'''
+
+# 其余页面的 KV 规则在首次进入该页面时才解析
+SCREEN_KV = {
+    'result': '''
+#:import hex kivy.utils.get_color_from_hex
 
 <ResultScreen>:
     MDBoxLayout:
@@ -114,62 +177,43 @@ KV = '''
         md_bg_color: hex('#FFFFFF')
 
         MDTopAppBar:
+            id: res_toolbar
             title: "分析结果"
             left_action_items: [["arrow-left", lambda x: app.switch_to('home')]]
             right_action_items: [["volume-high", lambda x: app.speak_result()]]
 
-        ScrollView:
-            MDBoxLayout:
-                orientation: 'vertical'
-                padding: "20dp"
-                spacing: "15dp"
+        MDBoxLayout:
+            orientation: 'vertical'
+            padding: "20dp", "20dp", "20dp", "15dp"
+            spacing: "15dp"
+            adaptive_height: True
+
+            MDLabel:
+                id: res_title
+                text: "加载中..."
+                font_style: "H5"
+                bold: True
                 adaptive_height: True
 
-                MDLabel:
-                    id: res_title
-                    text: "加载中..."
-                    font_style: "H5"
-                    bold: True
-                    adaptive_height: True
-
-                MDSeparator:
-
-                MDLabel:
-                    text: "核心结论"
-                    color: hex('#D32F2F')
-                    font_style: "Subtitle1"
-                    bold: True
-                    adaptive_height: True
-                MDLabel:
-                    id: res_core
-                    text: "..."
-                    font_style: "Body1"
-                    adaptive_height: True
-
-                MDLabel:
-                    text: "异常分析"
-                    color: hex('#F57C00')
-                    font_style: "Subtitle1"
-                    bold: True
-                    adaptive_height: True
-                MDLabel:
-                    id: res_abnormal
-                    text: "..."
-                    font_style: "Body1"
-                    adaptive_height: True
-
-                MDLabel:
-                    text: "生活建议"
-                    color: hex('#388E3C')
-                    font_style: "Subtitle1"
-                    bold: True
-                    adaptive_height: True
-                MDLabel:
-                    id: res_advice
-                    text: "..."
-                    font_style: "Body1"
-                    adaptive_height: True
+            MDSeparator:
 
+        # 正文按段落拆成多行，长报告也只为可见行排版和生成纹理
+        MDRecycleView:
+            id: res_list
+            viewclass: 'ResultRow'
+            MDRecycleBoxLayout:
+                padding: "20dp", 0, "20dp", "20dp"
+                default_size: None, dp(48)
+                default_size_hint: 1, None
+                size_hint_y: None
+                height: self.minimum_height
+                orientation: 'vertical'
+
+<ResultRow>:
+    size_hint_y: None
+    valign: 'top'
+''',
+    'history': '''
 <HistoryScreen>:
     MDBoxLayout:
         orientation: 'vertical'
@@ -177,17 +221,48 @@ KV = '''
         MDTopAppBar:
             title: "历史记录"
             left_action_items: [["arrow-left", lambda x: app.switch_to('home')]]
+            right_action_items: [["chart-line", lambda x: app.switch_to('trends')]]
+
+        MDTextField:
+            id: history_search
+            hint_text: "搜索历史报告"
+            mode: "rectangle"
+            size_hint_x: 0.94
+            pos_hint: {"center_x": .5}
+            on_text: app.search_trigger()
 
         MDRecycleView:
             id: history_list
             viewclass: 'TwoLineAvatarIconListItem'
+            on_scroll_y: app.on_history_scroll(self)
             MDRecycleBoxLayout:
                 default_size: None, dp(72)
                 default_size_hint: 1, None
                 size_hint_y: None
                 height: self.minimum_height
                 orientation: 'vertical'
+''',
+    'trends': '''
+<TrendScreen>:
+    MDBoxLayout:
+        orientation: 'vertical'
+
+        MDTopAppBar:
+            id: trend_bar
+            title: "指标趋势"
+            left_action_items: [["arrow-left", lambda x: app.trend_back()]]
 
+        MDRecycleView:
+            id: trend_list
+            viewclass: 'TwoLineAvatarIconListItem'
+            MDRecycleBoxLayout:
+                default_size: None, dp(72)
+                default_size_hint: 1, None
+                size_hint_y: None
+                height: self.minimum_height
+                orientation: 'vertical'
+''',
+    'settings': '''
 <SettingsScreen>:
     MDBoxLayout:
         orientation: 'vertical'
@@ -226,13 +301,49 @@ KV = '''
             size_hint_x: 1
             on_release: app.save_config()
 
+        MDFlatButton:
+            text: "性能诊断"
+            size_hint_x: 1
+            on_release: app.switch_to('diagnostics')
+
+        MDFlatButton:
+            text: "导出历史记录"
+            size_hint_x: 1
+            on_release: app.export_history()
+
+        MDFlatButton:
+            text: "导入历史记录"
+            size_hint_x: 1
+            on_release: app.import_history()
+
         MDFlatButton:
             text: "取消"
             size_hint_x: 1
             on_release: app.switch_to('home')
 
         Widget:
-'''
+''',
+    'diagnostics': '''
+<DiagnosticsScreen>:
+    MDBoxLayout:
+        orientation: 'vertical'
+
+        MDTopAppBar:
+            title: "性能诊断"
+            left_action_items: [["arrow-left", lambda x: app.switch_to('settings')]]
+            right_action_items: [["refresh", lambda x: app.load_diagnostics()], ["export", lambda x: app.export_diagnostics()]]
+
+        MDRecycleView:
+            id: diag_list
+            viewclass: 'TwoLineListItem'
+            MDRecycleBoxLayout:
+                default_size: None, dp(72)
+                default_size_hint: 1, None
+                size_hint_y: None
+                height: self.minimum_height
+                orientation: 'vertical'
+''',
+}
 
 
 class HomeScreen(MDScreen): pass
@@ -244,29 +355,87 @@ class ResultScreen(MDScreen): pass
 class HistoryScreen(MDScreen): pass
 
 
+class TrendScreen(MDScreen): pass
+
+
 class SettingsScreen(MDScreen): pass
 
 
+class DiagnosticsScreen(MDScreen): pass
+
+
+SCREEN_CLASSES = {
+    'home': HomeScreen,
+    'result': ResultScreen,
+    'history': HistoryScreen,
+    'trends': TrendScreen,
+    'settings': SettingsScreen,
+    'diagnostics': DiagnosticsScreen,
+}
+
+
 class MedicalApp(MDApp):
     def build(self):
+        mark_startup('build')
         self.theme_cls.primary_palette = "Green"
+        # 构造只做轻量工作，数据库、网络库和 TTS 在后台线程初始化
         self.backend = BackendService()
-
-        # 加载 UI
+        self.partial_result = None
+        self.render_seq = 0
+        self.active_job = None
+        self.cancelled_jobs = set()
+        self.partial_trigger = Clock.create_trigger(self.flush_partial_result, 0.1)
+        self.search_trigger = Clock.create_trigger(self.search_history, 0.3)
+
+        # 加载 UI：启动时只创建首页，其余页面在首次进入时创建
         self.sm = Builder.load_string(KV)
 
         self.screen_manager = ScreenManager()
         self.screen_manager.add_widget(HomeScreen(name='home'))
-        self.screen_manager.add_widget(ResultScreen(name='result'))
-        self.screen_manager.add_widget(HistoryScreen(name='history'))
-        self.screen_manager.add_widget(SettingsScreen(name='settings'))
 
         # 启动逻辑
         self.load_user_config()
         self.request_perms()
-
+        self.backend.start_background(self.on_backend_ready)
+        mark_startup('home')
         return self.screen_manager
 
+    def on_start(self):
+        Clock.schedule_once(self.on_first_frame, 0)
+
+    def on_first_frame(self, *args):
+        mark_startup('first_frame')
+        self.flush_startup_marks()
+
+    @mainthread
+    def on_backend_ready(self):
+        mark_startup('backend_ready')
+        if self.app_config.getboolean('network', 'warm_up', fallback=True):
+            self.backend.warm_up()
+        self.backend.start_maintenance()
+
+        # 恢复上次未完成的分析任务
+        resumed = self.backend.start_jobs(lambda: self.keys, self.on_background_job)
+        if resumed:
+            toast(f"继续处理 {resumed} 个未完成的分析")
+        self.flush_startup_marks()
+
+    def flush_startup_marks(self):
+        if not self.backend.is_ready():
+            return
+        while STARTUP_MARKS:
+            name, ms = STARTUP_MARKS.pop(0)
+            self.backend.metrics.record('startup', ms, name)
+
+    def get_screen(self, name):
+        # 首次访问时才解析对应的 KV 规则并创建页面
+        if not self.screen_manager.has_screen(name):
+            start = time.perf_counter()
+            Builder.load_string(SCREEN_KV[name])
+            self.screen_manager.add_widget(SCREEN_CLASSES[name](name=name))
+            print(f"[UI] built screen {name} in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return self.screen_manager.get_screen(name)
+
     def request_perms(self):
         from kivy.utils import platform
         if platform == 'android':
@@ -298,8 +467,35 @@ class MedicalApp(MDApp):
             'ali_sk': self.app_config.get('keys', 'ali_sk', fallback='')
         }
 
+        hedge = self.app_config.get('network', 'hedge_delay', fallback='').strip()
+        self.backend.hedge_delay = float(hedge) if hedge else None
+        self.backend.deadline = self.app_config.getfloat('network', 'deadline', fallback=self.backend.deadline)
+        self.backend.metrics.enabled = self.app_config.getboolean('diagnostics', 'metrics',
+                                                                  fallback=self.backend.metrics.enabled)
+
+        self.backend.prompt_budget = self.app_config.getint('prompt', 'token_budget',
+                                                            fallback=self.backend.prompt_budget)
+        self.backend.map_reduce = self.app_config.getboolean('prompt', 'map_reduce',
+                                                             fallback=self.backend.map_reduce)
+
+        # 可选的历史记录保留策略
+        if self.app_config.has_section('storage'):
+            policy = self.backend.retention
+            for name in ('max_rows', 'max_bytes', 'max_age_days'):
+                value = self.app_config.get('storage', name, fallback='').strip()
+                if value:
+                    policy[name] = int(value) if value.lower() != 'none' else None
+
+        # 可选的图片预处理参数
+        if self.app_config.has_section('image'):
+            opts = self.backend.image_options
+            opts['max_edge'] = self.app_config.getint('image', 'max_edge', fallback=opts['max_edge'])
+            opts['format'] = self.app_config.get('image', 'format', fallback=opts['format'])
+            opts['quality'] = self.app_config.getint('image', 'quality', fallback=opts['quality'])
+            opts['grayscale'] = self.app_config.getboolean('image', 'grayscale', fallback=opts['grayscale'])
+
     def save_config(self):
-        sc = self.screen_manager.get_screen('settings')
+        sc = self.get_screen('settings')
         self.app_config.set('keys', 'tongyi_key', sc.ids.key_tongyi.text)
         self.app_config.set('keys', 'deepseek_key', sc.ids.key_deepseek.text)
         self.app_config.set('keys', 'ali_ak', sc.ids.key_ak.text)
@@ -313,11 +509,16 @@ class MedicalApp(MDApp):
         self.switch_to('home')
 
     def switch_to(self, screen_name):
+        self.get_screen(screen_name)
         self.screen_manager.current = screen_name
         if screen_name == 'history':
             self.load_history()
+        if screen_name == 'trends':
+            self.load_trend_tests()
+        if screen_name == 'diagnostics':
+            self.load_diagnostics()
         if screen_name == 'settings':
-            sc = self.screen_manager.get_screen('settings')
+            sc = self.get_screen('settings')
             sc.ids.key_tongyi.text = self.keys['tongyi_key']
             sc.ids.key_deepseek.text = self.keys['deepseek_key']
             sc.ids.key_ak.text = self.keys['ali_ak']
@@ -329,34 +530,204 @@ class MedicalApp(MDApp):
     def action_gallery(self):
         self.backend.open_gallery(self.on_image_ready)
 
+    def action_camera_batch(self):
+        self.batch_pages = []
+        self.backend.open_camera(self.on_batch_page)
+
+    def on_batch_page(self, path):
+        if path:
+            self.batch_pages.append(path)
+        if not self.batch_pages:
+            return
+
+        from kivymd.uix.button import MDFlatButton
+        from kivymd.uix.dialog import MDDialog
+
+        def next_page(*args):
+            self.batch_dialog.dismiss()
+            self.backend.open_camera(self.on_batch_page)
+
+        def start(*args):
+            self.batch_dialog.dismiss()
+            self.on_image_ready(list(self.batch_pages))
+
+        self.batch_dialog = MDDialog(
+            title=f"已拍摄 {len(self.batch_pages)} 页",
+            text="继续拍摄下一页，或开始分析全部页面",
+            auto_dismiss=False,
+            buttons=[
+                MDFlatButton(text="继续拍摄", on_release=next_page),
+                MDFlatButton(text="开始分析", on_release=start),
+            ]
+        )
+        self.batch_dialog.open()
+
     def on_image_ready(self, path):
         if not path: return
+        paths = path if isinstance(path, list) else [path]
         self.show_loading()
-        threading.Thread(target=self.run_analysis, args=(path,)).start()
+        self.partial_result = None
+        # 任务写入在数据库写线程中完成，active_job 为结果是任务 id 的 Future
+        self.active_job = self.backend.jobs.submit(paths, listener=self.on_job_event)
+        self.active_job.add_done_callback(self.on_job_submitted)
+
+    def on_job_submitted(self, fut):
+        # 数据库写线程回调；写入失败且未被取消时直接展示失败结果
+        if fut.exception() is not None and fut is self.active_job:
+            print(f"Job Submit Error: {fut.exception()}")
+            self.finish_job(None, self.backend.failed_result())
+
+    def cancel_analysis(self, *args):
+        # 中断正在进行的请求，结果不再展示；任务尚未写入时在写入完成后取消
+        job, self.active_job = self.active_job, None
+        if job is not None:
+            job.add_done_callback(self._cancel_job)
+        self.partial_result = None
+        if hasattr(self, 'dialog') and self.dialog:
+            self.dialog.dismiss()
+            self.dialog = None
+        if self.screen_manager.current == 'result':
+            # 从结果页停止时，已显示的部分结果替换为取消提示
+            cancelled = self.backend.cancelled_result()
+            self.render_result(cancelled['title'], cancelled, reset=True)
+        elif self.screen_manager.has_screen('result'):
+            self.update_result_actions()
+        toast("已取消分析")
+
+    def _cancel_job(self, fut):
+        if fut.exception() is None:
+            self.cancelled_jobs.add(fut.result())
+            self.backend.jobs.cancel(fut.result())
+
+    def on_job_event(self, job_id, event, payload):
+        # 分析队列工作线程回调；已取消的任务不再刷新界面
+        if job_id in self.cancelled_jobs:
+            return
+        if event == 'progress':
+            self.on_analysis_progress(*payload)
+        elif event == 'retry':
+            self.show_retry(payload['delay'])
+        elif event in ('done', 'failed'):
+            self.finish_job(job_id, payload)
+
+    def on_background_job(self, job_id, event, payload):
+        if event == 'done':
+            self.notify("后台分析已完成，结果已保存到历史记录")
+
+    @mainthread
+    def notify(self, text):
+        toast(text)
+
+    @mainthread
+    def show_retry(self, delay):
+        if hasattr(self, 'dialog') and self.dialog:
+            self.dialog.text = f"网络异常，{delay:.0f} 秒后自动重试..."
+
+    def on_analysis_progress(self, stage, fields):
+        # 后台线程回调，合并到下一帧统一刷新，避免每个 token 都触发重绘
+        self.partial_result = (stage, fields)
+        self.partial_trigger()
+
+    def flush_partial_result(self, *args):
+        if not self.partial_result:
+            return
+        stage, fields = self.partial_result
+        if stage == 'page':
+            if hasattr(self, 'dialog') and self.dialog:
+                self.dialog.text = f"已识别 {fields['done']}/{fields['total']} 页..."
+            return
+
+        if hasattr(self, 'dialog') and self.dialog:
+            self.dialog.dismiss()
+            self.dialog = None
 
-    def run_analysis(self, path):
-        res = self.backend.analyze_report(path, self.keys)
-        self.update_result_ui(res)
-        self.backend.save_record(res)
+        if stage == 'extract':
+            self.render_result("正在识别...", {'abnormal_analysis': fields.get('abnormal_analysis')})
+        else:
+            self.render_result(fields.get('title') or "正在解读...", fields)
+
+        if self.screen_manager.current != 'result':
+            self.switch_to('result')
+
+    def active_job_id(self):
+        job = self.active_job
+        if job is None or not job.done() or job.exception() is not None:
+            return None
+        return job.result()
+
+    @mainthread
+    def finish_job(self, job_id, data):
+        # job_id 为 None 表示任务未能写入
+        if job_id is None or job_id == self.active_job_id():
+            self.active_job = None
+        self.update_result_ui(data)
+
+    def update_result_actions(self):
+        # 分析进行中时结果页显示停止按钮：加载对话框在首个流式片段到达时关闭，之后仍需能取消，
+        # 否则卡住的流式请求会占用分析队列直到截止时间
+        actions = [["volume-high", lambda x: self.speak_result()]]
+        if self.active_job is not None:
+            actions.insert(0, ["stop-circle-outline", lambda x: self.cancel_analysis()])
+        toolbar = self.get_screen('result').ids.res_toolbar
+        if [a[0] for a in toolbar.right_action_items] != [a[0] for a in actions]:
+            toolbar.right_action_items = actions
 
     @mainthread
     def update_result_ui(self, data):
+        self.partial_result = None
         if hasattr(self, 'dialog') and self.dialog:
             self.dialog.dismiss()
 
-        sc = self.screen_manager.get_screen('result')
-        sc.ids.res_title.text = data.get('title', '分析完成')
-        sc.ids.res_core.text = data.get('core_conclusion', '无内容')
-        sc.ids.res_abnormal.text = str(data.get('abnormal_analysis', '无异常'))
-        sc.ids.res_advice.text = str(data.get('life_advice', '无建议'))
+        self.render_result(data.get('title', '分析完成'), {
+            'core_conclusion': data.get('core_conclusion', '无内容'),
+            'abnormal_analysis': str(data.get('abnormal_analysis', '无异常')),
+            'life_advice': str(data.get('life_advice', '无建议')),
+        }, reset=True)
 
         self.current_res_text = data.get('core_conclusion', '')
         self.switch_to('result')
         self.backend.speak("分析完成")
+        self.backend.prepare_speech(self.current_res_text)
+
+    def render_result(self, title, fields, reset=False):
+        # 分段和行高估算在后台线程完成，主线程只替换 RecycleView 的 data；
+        # 流式刷新较快时只采用最后一次的结果
+        sc = self.get_screen('result')
+        sc.ids.res_title.text = title
+        self.update_result_actions()
+        rv = sc.ids.res_list
+        width = (rv.width if rv.width > dp(100) else Window.width) - dp(40)
+        fonts = {style: sp(self.theme_cls.font_styles[style][1]) for style in ('Subtitle1', 'Body1')}
+        sections = [(heading, get_color_from_hex(color), fields.get(key) or "...")
+                    for key, heading, color in RESULT_SECTIONS]
+        self.render_seq += 1
+        seq = self.render_seq
+
+        def build():
+            self.apply_result_rows(seq, build_rows(sections, width, fonts, dp(RESULT_ROW_GAP)), reset)
+
+        threading.Thread(target=build, daemon=True).start()
+
+    @mainthread
+    def apply_result_rows(self, seq, rows, reset):
+        if seq != self.render_seq:
+            return
+        rv = self.get_screen('result').ids.res_list
+        rv.data = rows
+        if reset:
+            rv.scroll_y = 1
 
     @mainthread
     def show_loading(self):
-        self.dialog = MDDialog(title="正在分析...", text="请稍候，AI正在解读您的报告", auto_dismiss=False)
+        from kivymd.uix.button import MDFlatButton
+        from kivymd.uix.dialog import MDDialog
+
+        self.dialog = MDDialog(
+            title="正在分析...",
+            text="请稍候，AI正在解读您的报告",
+            auto_dismiss=False,
+            buttons=[MDFlatButton(text="取消", on_release=self.cancel_analysis)]
+        )
         self.dialog.open()
 
     def open_settings(self):
@@ -367,29 +738,176 @@ class MedicalApp(MDApp):
             self.backend.speak(self.current_res_text)
 
     def load_history(self):
-        data = self.backend.get_history()
-        sc = self.screen_manager.get_screen('history')
+        sc = self.get_screen('history')
+        if sc.ids.history_search.text.strip():
+            self.search_history()
+            return
         sc.ids.history_list.data = []
-        if not data:
+        self.history_last_id = None
+        self.history_has_more = True
+        self.load_history_page()
+        if not sc.ids.history_list.data:
             toast("暂无历史记录")
+
+    def load_history_page(self):
+        if not self.history_has_more:
+            return
+        rows = self.backend.get_history_page(self.history_last_id)
+        if len(rows) < HISTORY_PAGE_SIZE:
+            self.history_has_more = False
+        if not rows:
             return
 
-        sc.ids.history_list.data = [
+        self.history_last_id = rows[-1][0]
+        sc = self.get_screen('history')
+        sc.ids.history_list.data.extend(
             {
                 'viewclass': 'TwoLineAvatarIconListItem',
                 'text': item[2],
                 'secondary_text': item[1],
                 'icon': "file-document",
-                'on_release': lambda x=item[4]: self.show_history_detail(x)
-            } for item in data
+                'on_release': lambda x=item[0]: self.show_history_detail(x)
+            } for item in rows
+        )
+
+    def search_history(self, *args):
+        sc = self.get_screen('history')
+        query = sc.ids.history_search.text.strip()
+        if not query:
+            self.load_history()
+            return
+
+        self.history_has_more = False
+        sc.ids.history_list.data = [
+            {
+                'viewclass': 'TwoLineAvatarIconListItem',
+                'text': item[2],
+                'secondary_text': self.highlight(item[3] or item[1]),
+                'icon': "file-search",
+                'on_release': lambda x=item[0]: self.show_history_detail(x)
+            } for item in self.backend.search_history(query)
         ]
 
-    def show_history_detail(self, json_str):
-        try:
-            data = json.loads(json_str)
+    @staticmethod
+    def highlight(snippet):
+        text = escape_markup(snippet)
+        return text.replace(HIT_START, '[b][color=#D32F2F]').replace(HIT_END, '[/color][/b]')
+
+    def on_history_scroll(self, rv):
+        # 滚动接近底部时加载下一页
+        if rv.scroll_y <= 0.1 and getattr(self, 'history_has_more', False):
+            self.load_history_page()
+
+    def show_history_detail(self, record_id):
+        # 读取和解压记录放在后台线程，长报告打开时不阻塞界面
+        def load():
+            data = self.backend.get_record(record_id)
+            if data is None:
+                self.notify("记录损坏")
+                return
             self.update_result_ui(data)
-        except:
-            toast("记录损坏")
+
+        threading.Thread(target=load, daemon=True).start()
+
+    def load_trend_tests(self):
+        sc = self.get_screen('trends')
+        sc.ids.trend_bar.title = "指标趋势"
+        self.trend_key = None
+        tests = self.backend.get_lab_tests()
+        sc.ids.trend_list.data = [
+            {
+                'viewclass': 'TwoLineAvatarIconListItem',
+                'text': key if key == name else f"{name} ({key})",
+                'secondary_text': f"共 {count} 次检测",
+                'icon': "chart-line",
+                'on_release': lambda x=key, n=name: self.show_trend(x, n)
+            } for key, name, count in tests
+        ]
+        if not tests:
+            toast("暂无检验指标")
+
+    def show_trend(self, key, name):
+        sc = self.get_screen('trends')
+        sc.ids.trend_bar.title = name
+        self.trend_key = key
+        arrows = {'H': " ↑", 'L': " ↓"}
+        items = []
+        for created_at, value, unit, low, high, flag, record_id in reversed(self.backend.get_lab_trend(key)):
+            ref = ""
+            if low is not None or high is not None:
+                ref = "  参考 %s-%s" % ('' if low is None else f"{low:g}", '' if high is None else f"{high:g}")
+            items.append({
+                'viewclass': 'TwoLineAvatarIconListItem',
+                'text': f"{value:g} {unit}{arrows.get(flag, '')}",
+                'secondary_text': datetime.fromtimestamp(created_at).strftime("%Y-%m-%d %H:%M") + ref,
+                'icon': "alert-circle" if flag in arrows else "check-circle",
+                'on_release': lambda x=record_id: self.show_history_detail(x)
+            })
+        sc.ids.trend_list.data = items
+
+    def load_diagnostics(self):
+        sc = self.get_screen('diagnostics')
+        items = []
+        for row in self.backend.metrics.summary():
+            name = f"{row['stage']} · {row['provider']}" if row['provider'] else row['stage']
+            detail = f"p50 {row['p50']:.0f} ms · p95 {row['p95']:.0f} ms · 最长 {row['max']:.0f} ms"
+            if row['avg_bytes'] is not None:
+                detail += f" · 平均 {row['avg_bytes'] / 1024:.1f} KB"
+            errors = f"，失败 {row['errors']}" if row['errors'] else ""
+            items.append({
+                'viewclass': 'TwoLineListItem',
+                'text': f"{name}（{row['count']} 次{errors}）",
+                'secondary_text': detail,
+            })
+        sc.ids.diag_list.data = items
+        if not items:
+            toast("暂无数据" if self.backend.metrics.enabled else "性能记录未启用")
+
+    def export_diagnostics(self):
+        path = os.path.join(self.backend.get_cache_dir(),
+                            f"diagnostics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        try:
+            count = self.backend.metrics.export(path)
+            toast(f"已导出 {count} 条记录：{path}")
+        except Exception as e:
+            print(f"Export Error: {e}")
+            toast("导出失败")
+
+    def export_history(self):
+        # 导出和导入都在后台线程执行，完成后提示
+        def run():
+            try:
+                stats = self.backend.export_history(include_images=True)
+                self.notify(f"已导出 {stats['records']} 条记录：{stats['path']}")
+            except Exception as e:
+                print(f"Archive Export Error: {e}")
+                self.notify("导出失败")
+
+        toast("正在导出...")
+        threading.Thread(target=run, daemon=True).start()
+
+    def import_history(self):
+        path = self.backend.find_archive()
+        if not path:
+            toast(f"请先将归档文件放入 {self.backend.get_cache_dir()}")
+            return
+
+        def run():
+            try:
+                stats = self.backend.import_history(path)
+                self.notify(f"导入 {stats['imported']} 条，跳过重复 {stats['duplicates']} 条")
+            except Exception as e:
+                print(f"Archive Import Error: {e}")
+                self.notify("导入失败")
+
+        toast("正在导入...")
+        threading.Thread(target=run, daemon=True).start()
+
+    def trend_back(self):
+        if getattr(self, 'trend_key', None):
+            self.load_trend_tests()
+        else:
+            self.switch_to('history')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import json
+import math
+import time
+
+from providers import Cancelled
+
+# 诊断页面按此顺序展示各阶段
+STAGES = ('startup', 'extract', 'read', 'preprocess', 'encode', 'upload', 'model', 'receive', 'parse',
+          'format', 'db_write')
+# metrics 表最多保留的行数，超出部分在后台维护时删除
+METRICS_MAX_ROWS = 5000
+# 诊断页面统计最近 7 天的数据
+SUMMARY_WINDOW = 7 * 24 * 3600
+
+
+def percentile(values, pct):
+    # 最近秩法：取排序后第 ceil(pct% × n) 个值，样本较少时结果稳定。
+    # 先乘后除，避免 0.7 × 10 这类浮点误差使秩多出 1
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct * len(ordered) / 100.0))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class _NullSpan:
+    # 未启用时共用的空操作 span，属性写入直接丢弃
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ('metrics', 'stage', 'provider', 'bytes', 'outcome', 'start')
+
+    def __init__(self, metrics, stage, provider=None, nbytes=None):
+        self.metrics = metrics
+        self.stage = stage
+        self.provider = provider
+        self.bytes = nbytes
+        self.outcome = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = self.outcome
+        if outcome is None:
+            if exc_type is None:
+                outcome = 'ok'
+            else:
+                outcome = 'cancelled' if issubclass(exc_type, Cancelled) else 'error'
+        self.metrics.record(self.stage, (time.perf_counter() - self.start) * 1000,
+                            self.provider, self.bytes, outcome)
+        return False
+
+
+class Metrics:
+    """分阶段耗时记录，写入滚动的 metrics 表。
+
+    用法：with metrics.span('upload', 'dashscope') as span: ...；span.bytes、span.outcome 可在块内设置，
+    未设置 outcome 时按是否抛出异常记为 ok / error / cancelled。关闭后 span() 返回空操作对象，不产生写入。
+    启动阶段的时间点记为 stage='startup'，provider 列保存时间点名称。
+    """
+
+    def __init__(self, db, enabled=True):
+        self.db = db
+        self.enabled = enabled
+
+    def span(self, stage, provider=None, nbytes=None):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, stage, provider, nbytes)
+
+    def record(self, stage, ms, provider=None, nbytes=None, outcome='ok'):
+        # 数据库尚未打开时（启动阶段）丢弃记录
+        if not self.enabled or self.db is None:
+            return
+        self.db.execute(
+            'INSERT INTO metrics (stage, provider, ms, bytes, outcome, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (stage, provider, round(ms, 2), nbytes, outcome, time.time())
+        )
+
+    def prune(self, max_rows=METRICS_MAX_ROWS):
+        return self.db.submit(lambda conn: conn.execute(
+            'DELETE FROM metrics WHERE id <= (SELECT MAX(id) FROM metrics) - ?', (max_rows,)).rowcount).result()
+
+    def rows(self, since=None):
+        if since is None:
+            since = time.time() - SUMMARY_WINDOW
+        return self.db.query('''
+            SELECT stage, provider, ms, bytes, outcome, created_at FROM metrics
+            WHERE created_at >= ? ORDER BY id
+        ''', (since,))
+
+    def summary(self, since=None):
+        return self._summarize(self.rows(since))
+
+    @staticmethod
+    def _summarize(rows):
+        # 按 (阶段, 服务商) 统计次数、失败数、p50/p95/最大耗时和平均字节数
+        groups = {}
+        for stage, provider, ms, nbytes, outcome, _ in rows:
+            groups.setdefault((stage, provider or ''), []).append((ms, nbytes, outcome))
+
+        order = {name: i for i, name in enumerate(STAGES)}
+        result = []
+        for (stage, provider), items in sorted(groups.items(), key=lambda kv: (order.get(kv[0][0], len(order)), kv[0])):
+            times = [ms for ms, _, _ in items]
+            sizes = [b for _, b, _ in items if b is not None]
+            result.append({
+                'stage': stage,
+                'provider': provider,
+                'count': len(items),
+                'errors': sum(1 for _, _, outcome in items if outcome != 'ok'),
+                'p50': percentile(times, 50),
+                'p95': percentile(times, 95),
+                'max': max(times),
+                'avg_bytes': int(sum(sizes) / len(sizes)) if sizes else None,
+            })
+        return result
+
+    def export(self, path, since=None):
+        rows = self.rows(since)
+        data = {
+            'exported_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'summary': self._summarize(rows),
+            'rows': [dict(zip(('stage', 'provider', 'ms', 'bytes', 'outcome', 'created_at'), r)) for r in rows],
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        return len(rows)
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+import base64
+import io
+import json
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+DASHSCOPE_BASE = "https://dashscope.aliyuncs.com"
+DEEPSEEK_BASE = "https://api.deepseek.com"
+
+VL_PATH = "/api/v1/services/aigc/multimodal-generation/generation"
+CHAT_PATH = "/v1/chat/completions"
+
+# 仅对限流和网关类错误重试；读超时不重试，避免单次分析耗时翻倍
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# 一次分析（识别 + 整理）的总时间预算，以及单次请求的最短超时（秒）
+DEFAULT_DEADLINE = 45.0
+MIN_CALL_TIMEOUT = 2.0
+
+# 请求体中图片 data URL 的占位符，发送时替换为分块编码的 base64
+DATA_URL = '\x00data_url\x00'
+# 每次读取并编码的原始字节数，需为 3 的倍数，各块编码结果才能直接拼接
+B64_CHUNK = 48 * 1024
+
+
+class Cancelled(Exception):
+    pass
+
+
+class DeadlineExceeded(Cancelled):
+    pass
+
+
+def _close_quietly(resp):
+    # 先 shutdown 套接字，唤醒阻塞在 recv 上的读取线程，再关闭响应
+    try:
+        resp.raw._fp.fp.raw._sock.shutdown(socket.SHUT_RDWR)
+    except (AttributeError, OSError):
+        pass
+    try:
+        resp.close()
+    except Exception:
+        pass
+
+
+def _abort_socket(sock):
+    # SO_LINGER 为 0 时关闭连接发送 RST，内核中尚未发出的请求体直接丢弃；shutdown 唤醒阻塞在发送上的线程
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    except (AttributeError, OSError):
+        pass
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except (AttributeError, OSError):
+        pass
+
+
+# 请求线程中正在发送的请求，见 ProviderClient._send
+_request_local = threading.local()
+
+
+def _track_socket(sock):
+    handle = getattr(_request_local, 'handle', None)
+    if handle is None or sock is None or sock in _request_local.sockets:
+        return
+    _request_local.sockets.add(sock)
+    handle.attach(sock)
+
+
+def _tracking_pools():
+    # 连接池使用的连接在建立和发送时把套接字登记到当前请求的分析句柄，urllib3 1.x 与 2.x 都经由 send 发送
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class Tracked:
+        def connect(self):
+            super().connect()
+            _track_socket(self.sock)
+
+        def send(self, data):
+            _track_socket(self.sock)
+            return super().send(data)
+
+    class TrackedHTTPConnection(Tracked, HTTPConnection):
+        pass
+
+    class TrackedHTTPSConnection(Tracked, HTTPSConnection):
+        pass
+
+    class TrackedHTTPPool(HTTPConnectionPool):
+        ConnectionCls = TrackedHTTPConnection
+
+    class TrackedHTTPSPool(HTTPSConnectionPool):
+        ConnectionCls = TrackedHTTPSConnection
+
+    return {'http': TrackedHTTPPool, 'https': TrackedHTTPSPool}
+
+
+def _close_result(fut):
+    # 已放弃的请求返回后立即关闭连接，不放回连接池
+    if not fut.cancelled() and fut.exception() is None:
+        _close_quietly(fut.result())
+
+
+class AnalysisHandle:
+    """一次分析的取消句柄，携带贯穿所有阶段的统一截止时间。
+
+    已返回响应头的请求登记响应，尚在上传的请求登记套接字；取消或超时放弃等待时一并关闭，
+    上传中的请求体不会在后台线程中继续发送。
+    """
+
+    def __init__(self, budget=DEFAULT_DEADLINE):
+        self.budget = budget
+        self.deadline = time.monotonic() + budget
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._responses = set()
+        self._sockets = set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled()
+        if self.remaining() <= 0:
+            raise DeadlineExceeded()
+
+    def timeout(self, share=1.0):
+        # 当前调用可使用剩余预算的 share 比例，后续阶段保留其余部分
+        self.check()
+        remaining = self.remaining()
+        return max(min(remaining, MIN_CALL_TIMEOUT), remaining * share)
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            responses = list(self._responses)
+            self._responses.clear()
+        for resp in responses:
+            _close_quietly(resp)
+        self._abort_uploads()
+
+    def attach(self, sock):
+        # 由请求线程在发送前调用；已取消时立即中断
+        with self._lock:
+            if not self._event.is_set():
+                self._sockets.add(sock)
+                return
+        _abort_socket(sock)
+        raise Cancelled()
+
+    def detach(self, sockets):
+        # 响应头已返回，连接之后由响应对象管理，可能放回连接池供其他分析复用
+        with self._lock:
+            self._sockets.difference_update(sockets)
+
+    def _abort_uploads(self):
+        with self._lock:
+            sockets = list(self._sockets)
+            self._sockets.clear()
+        for sock in sockets:
+            _abort_socket(sock)
+
+    def track(self, resp):
+        with self._lock:
+            if not self._event.is_set():
+                self._responses.add(resp)
+                return resp
+        _close_quietly(resp)
+        raise Cancelled()
+
+    def wait(self, fut):
+        # 等待请求返回响应头，期间每 100ms 检查一次取消和截止时间
+        while True:
+            try:
+                return fut.result(timeout=min(0.1, max(0.01, self.remaining())))
+            except FutureTimeout:
+                if self._event.is_set() or self.remaining() <= 0:
+                    fut.add_done_callback(_close_result)
+                    self._abort_uploads()
+                    self.check()
+            except Exception:
+                # 取消时中断上传会让请求报错，统一转换为 Cancelled
+                self.check()
+                raise
+
+
+class TimedBody(io.BytesIO):
+    """请求体，记录最后一个字节交给套接字的时间，用于区分上传耗时与模型耗时。
+
+    handle 由 ProviderClient.post 设置：每读取一块前检查取消和截止时间，抛出的异常使 urllib3
+    中断发送并关闭连接，上传不会在后台线程中继续跑完。
+    """
+
+    sent_at = None
+    handle = None
+
+    def read(self, size=-1):
+        if self.handle is not None:
+            self.handle.check()
+        chunk = super().read(size)
+        if not chunk and self.sent_at is None:
+            self.sent_at = time.perf_counter()
+        return chunk
+
+    def seek(self, pos, whence=0):
+        # 重试时请求体会被倒回开头，重新计时
+        self.sent_at = None
+        return super().seek(pos, whence)
+
+    def __len__(self):
+        return self.getbuffer().nbytes
+
+
+def b64_chunks(fileobj, chunk_size=B64_CHUNK):
+    # 逐块读取并编码，内存占用与文件大小无关
+    while True:
+        chunk = fileobj.read(chunk_size)
+        while chunk and len(chunk) % 3:
+            more = fileobj.read(chunk_size - len(chunk))
+            if not more:
+                break
+            chunk += more
+        if not chunk:
+            return
+        yield base64.b64encode(chunk)
+
+
+def b64_length(size):
+    return (size + 2) // 3 * 4
+
+
+class StreamedBody:
+    """由若干片段按需生成的请求体，片段为 bytes 或 (fileobj, size)，后者以 base64 分块编码后发送。
+
+    长度可预先算出，requests 据此发送 Content-Length 而不是分块传输；seek(0) 从头重新生成，
+    urllib3 重试时会调用。与 TimedBody 一样记录最后一个字节交给套接字的时间，并在读取时检查 handle。
+    """
+
+    sent_at = None
+    handle = None
+
+    def __init__(self, parts):
+        self.parts = [p if isinstance(p, bytes) else (p[0], p[0].tell(), p[1]) for p in parts]
+        self.length = sum(len(p) if isinstance(p, bytes) else b64_length(p[2]) for p in self.parts)
+        self.seek(0)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(lambda: self.read(B64_CHUNK), b'')
+
+    def _generate(self):
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            fileobj, start, _ = part
+            fileobj.seek(start)
+            yield from b64_chunks(fileobj)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=0):
+        if pos != 0 or whence != 0:
+            raise io.UnsupportedOperation('StreamedBody can only be rewound to the start')
+        self._chunks = self._generate()
+        self._buf = b''
+        self._pos = 0
+        self.sent_at = None
+        return 0
+
+    def read(self, size=-1):
+        if self.handle is not None:
+            self.handle.check()
+        while size is None or size < 0 or len(self._buf) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buf += chunk
+        if size is None or size < 0:
+            size = len(self._buf)
+        out, self._buf = self._buf[:size], self._buf[size:]
+        self._pos += len(out)
+        if not out and self.sent_at is None:
+            self.sent_at = time.perf_counter()
+        return out
+
+
+def json_body(data, image=None, size=0, mime='image/jpeg'):
+    """序列化 JSON 请求体。给出 image 时 data 中的 DATA_URL 占位符替换为该文件的 data URL，
+    图片内容在发送时才读取和编码，不会整体进入内存。"""
+    raw = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    if image is None:
+        return TimedBody(raw)
+    head, tail = raw.split(json.dumps(DATA_URL)[1:-1].encode('utf-8'))
+    return StreamedBody([head + f"data:{mime};base64,".encode('ascii'), (image, size), tail])
+
+
+def _run_async(fn, *args, **kwargs):
+    # 守护线程执行阻塞请求，被放弃时不会拖住进程退出
+    fut = Future()
+
+    def run():
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            fut.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return fut
+
+
+class ProviderClient:
+    """单个 AI 服务商的长连接会话，复用 TCP/TLS 连接并带指数退避重试。"""
+
+    def __init__(self, base_url, pool_size=4, retries=3, backoff=0.5):
+        # requests 及其依赖导入较慢，推迟到首次创建客户端时（通常在后台初始化线程中）
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=None,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        adapter.poolmanager.pool_classes_by_scheme = _tracking_pools()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def post(self, path, handle=None, share=1.0, **kwargs):
+        if handle is None:
+            return self.session.post(self.base_url + path, **kwargs)
+
+        # 超时取自分析句柄的剩余预算；响应体由调用方读取，取消时关闭响应即可中断。
+        # 响应头返回前取消或超时时，请求体停止读取，登记的套接字被中断（见 _send）
+        kwargs['timeout'] = handle.timeout(share)
+        if isinstance(kwargs.get('data'), (TimedBody, StreamedBody)):
+            kwargs['data'].handle = handle
+        kwargs['stream'] = True
+        resp = handle.wait(_run_async(self._send, handle, self.base_url + path, **kwargs))
+        return handle.track(resp)
+
+    def _send(self, handle, url, **kwargs):
+        # 在请求线程中执行：发送期间使用的套接字登记到 handle，返回响应头后注销
+        _request_local.handle, _request_local.sockets = handle, set()
+        try:
+            return self.session.post(url, **kwargs)
+        finally:
+            handle.detach(_request_local.sockets)
+            _request_local.handle = None
+
+    def warm_up(self, timeout=5):
+        # 提前完成 DNS/TCP/TLS 握手，连接留在连接池中供首次分析复用
+        from requests import RequestException
+
+        try:
+            self.session.head(self.base_url + '/', timeout=timeout).close()
+            return True
+        except RequestException as e:
+            print(f"Warm-up Error ({self.base_url}): {e}")
+            return False
+
+    def close(self):
+        self.session.close()
+
+
+def is_timeout(exc):
+    # 连接或读取超时。重试次数用尽（MaxRetryError）或流式读取响应体时，
+    # urllib3 的超时异常会被 requests 包装为 ConnectionError
+    from requests.exceptions import ConnectionError, Timeout
+    from urllib3.exceptions import TimeoutError as Urllib3Timeout
+
+    if isinstance(exc, Timeout):
+        return True
+    if not isinstance(exc, ConnectionError):
+        return False
+    return any(isinstance(getattr(a, 'reason', a), Urllib3Timeout) for a in exc.args)
+
+
+def iter_sse(resp):
+    # 逐行解析 Server-Sent Events，只关心 data: 行
+    for raw in resp.iter_lines():
+        if not raw:
+            continue
+        line = raw.decode('utf-8', 'replace') if isinstance(raw, bytes) else raw
+        if not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            break
+        try:
+            yield json.loads(data)
+        except ValueError:
+            continue
+
+
+def create_clients():
+    return {
+        'dashscope': ProviderClient(DASHSCOPE_BASE),
+        'deepseek': ProviderClient(DEEPSEEK_BASE),
+    }
+
+
+def warm_up_async(clients):
+    def run():
+        for client in clients.values():
+            client.warm_up()
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import math
+
+# 每行最多字数：超长段落按句子拆成多行，每行单独排版、生成较小的纹理
+ROW_MAX_CHARS = 300
+# 估算行高时的行距倍数
+LINE_HEIGHT = 1.25
+
+_SENTENCE_ENDS = '。！？!?；;'
+_CLAUSE_ENDS = '，,、 '
+
+
+def _cut_point(text, limit):
+    # 优先在句末标点处断开，其次在逗号处，找不到时按字数硬切
+    for marks in (_SENTENCE_ENDS, _CLAUSE_ENDS):
+        i = max(text.rfind(m, limit // 2, limit) for m in marks)
+        if i >= 0:
+            return i + 1
+    return limit
+
+
+def split_paragraphs(text, max_chars=ROW_MAX_CHARS):
+    rows = []
+    for para in str(text or '').splitlines():
+        para = para.strip()
+        while len(para) > max_chars:
+            cut = _cut_point(para, max_chars)
+            rows.append(para[:cut])
+            para = para[cut:].lstrip()
+        if para:
+            rows.append(para)
+    return rows
+
+
+def text_width(text, font_px):
+    # 中文等全角字符按一个字号计算，半角字符按 0.55 个字号估算
+    wide = sum(1 for c in text if ord(c) > 0x2e7f)
+    return (wide + (len(text) - wide) * 0.55) * font_px
+
+
+def estimate_height(text, font_px, width):
+    lines = max(1, math.ceil(text_width(text, font_px) / width)) if width > 0 else 1
+    return lines * font_px * LINE_HEIGHT
+
+
+def build_rows(sections, width, fonts, gap=0):
+    """把结果各部分展开为 RecycleView 的 data，可在后台线程调用。
+
+    sections 为 [(标题, 标题颜色, 正文)]，fonts 为 {'Subtitle1': 像素, 'Body1': 像素}。
+    高度按字数估算，视图实际排版后再修正；每行都带完整的属性，视图复用时不会残留上一行的样式。
+    """
+    rows = []
+    for heading, color, text in sections:
+        rows.append({'text': heading, 'font_style': 'Subtitle1', 'bold': True,
+                     'theme_text_color': 'Custom', 'text_color': color,
+                     'height': estimate_height(heading, fonts['Subtitle1'], width) + gap})
+        for para in split_paragraphs(text) or ['...']:
+            rows.append({'text': para, 'font_style': 'Body1', 'bold': False,
+                         'theme_text_color': 'Primary', 'text_color': (0, 0, 0, 1),
+                         'height': estimate_height(para, fonts['Body1'], width) + gap})
+    return rows
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+
+# TextToSpeech 队列模式与返回值
+QUEUE_FLUSH = 0
+QUEUE_ADD = 1
+TTS_SUCCESS = 0
+
+# 每段朗读的最大字数，远小于引擎单次上限 getMaxSpeechInputLength()（通常为 4000）
+MAX_CHUNK_CHARS = 120
+# 第一段尽量短，合成耗时短，按下朗读后立即出声
+FIRST_CHUNK_CHARS = 40
+# 合成音频缓存的总大小上限
+AUDIO_CACHE_BYTES = 30 * 1024 * 1024
+SYNTH_TIMEOUT = 30
+
+_SENTENCE = re.compile(r'[^。！？!?；;\n]*[。！？!?；;\n]+|[^。！？!?；;\n]+')
+_CLAUSE = re.compile(r'[^，,、：:]*[，,、：:]+|[^，,、：:]+')
+
+
+def _split_long(sentence, limit):
+    # 超长句子先按逗号切分，仍超长的按固定长度切
+    pieces = []
+    for clause in _CLAUSE.findall(sentence):
+        while len(clause) > limit:
+            pieces.append(clause[:limit])
+            clause = clause[limit:]
+        if clause.strip():
+            pieces.append(clause)
+    return pieces
+
+
+def _join(a, b):
+    return a + ' ' + b if a[-1:].isascii() and b[:1].isascii() else a + b
+
+
+def split_sentences(text, max_chars=MAX_CHUNK_CHARS, first_chars=FIRST_CHUNK_CHARS):
+    """把文字切分为适合逐段朗读的片段：首段较短，其后相邻短句合并以减少引擎调用。"""
+    pieces = []
+    for sentence in _SENTENCE.findall(str(text or '')):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        limit = first_chars if not pieces else max_chars
+        if len(sentence) <= limit:
+            pieces.append(sentence)
+        else:
+            pieces.extend(p.strip() for p in _split_long(sentence, limit))
+
+    chunks = []
+    for piece in pieces:
+        limit = first_chars if len(chunks) == 1 else max_chars
+        if chunks and len(chunks[-1]) + len(piece) <= limit:
+            chunks[-1] = _join(chunks[-1], piece)
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+def audio_key(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+def _wav_complete(path):
+    # 引擎在合成结束时才回填 RIFF 头中的长度，被中断的文件长度字段不匹配
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(12)
+    except OSError:
+        return False
+    return (size > 44 and head[:4] == b'RIFF' and head[8:12] == b'WAVE'
+            and int.from_bytes(head[4:8], 'little') == size - 8)
+
+
+class SpeechService:
+    """Android TextToSpeech 封装：分句排队朗读，并在后台把结果逐句合成为音频文件。
+
+    音频按句子哈希缓存在 cache_dir 中，通过 addSpeech() 注册后，引擎朗读同一句子时直接播放文件；
+    缓存总大小超过 max_bytes 时删除最久未使用的文件。tts 为 None 时（非 Android）所有方法均为空操作。
+    """
+
+    def __init__(self, tts, cache_dir, max_bytes=AUDIO_CACHE_BYTES):
+        self.tts = tts
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._registered = set()
+        self._pending = queue.Queue()
+        self._done = {}
+        self._listener = None
+        self._thread = None
+        if tts is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._bind_listener()
+
+    def _bind_listener(self):
+        from jnius import PythonJavaClass, java_method
+
+        done = self._done
+
+        class CompletedListener(PythonJavaClass):
+            __javainterfaces__ = ['android/speech/tts/TextToSpeech$OnUtteranceCompletedListener']
+            __javacontext__ = 'app'
+
+            @java_method('(Ljava/lang/String;)V')
+            def onUtteranceCompleted(self, utterance_id):
+                event = done.get(utterance_id)
+                if event:
+                    event.set()
+
+        # 保留引用，避免监听对象被回收
+        self._listener = CompletedListener()
+        self.tts.setOnUtteranceCompletedListener(self._listener)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"tts_{key}.wav")
+
+    def speak(self, text):
+        if self.tts is None:
+            return
+        for i, chunk in enumerate(split_sentences(text)):
+            self._register(chunk)
+            self.tts.speak(chunk, QUEUE_FLUSH if i == 0 else QUEUE_ADD, None, f"play_{i}")
+
+    def stop(self):
+        if self.tts is not None:
+            self.tts.stop()
+
+    def _register(self, chunk):
+        key = audio_key(chunk)
+        if key in self._registered:
+            return True
+        path = self.path(key)
+        if not os.path.exists(path):
+            return False
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.tts.addSpeech(chunk, path)
+        self._registered.add(key)
+        return True
+
+    def prepare(self, text):
+        # 结果生成后在后台预先合成，之后（包括从历史记录打开时）朗读直接播放缓存
+        if self.tts is None:
+            return
+        for chunk in split_sentences(text):
+            if not os.path.exists(self.path(audio_key(chunk))):
+                self._pending.put(chunk)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._synth_loop, name='tts-synth', daemon=True)
+            self._thread.start()
+
+    def _synth_loop(self):
+        from jnius import autoclass
+
+        File = autoclass('java.io.File')
+        while True:
+            try:
+                chunk = self._pending.get(timeout=60)
+            except queue.Empty:
+                return
+            key = audio_key(chunk)
+            path = self.path(key)
+            if os.path.exists(path):
+                continue
+
+            # 正在朗读时暂缓合成，避免与播放争用引擎
+            while self.tts.isSpeaking():
+                time.sleep(0.5)
+
+            part = path + '.part'
+            utterance_id = f"synth_{key}"
+            event = self._done[utterance_id] = threading.Event()
+            try:
+                if self.tts.synthesizeToFile(chunk, None, File(part), utterance_id) == TTS_SUCCESS:
+                    event.wait(SYNTH_TIMEOUT)
+                if _wav_complete(part):
+                    os.replace(part, path)
+                    self._evict()
+                elif os.path.exists(part):
+                    os.remove(part)
+            except Exception as e:
+                print(f"TTS Synth Error: {e}")
+            finally:
+                self._done.pop(utterance_id, None)
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not (name.startswith('tts_') and name.endswith('.wav')):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name[4:-4], path))
+
+        total = sum(e[1] for e in entries)
+        for _, size, key, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            # 本次运行已注册给引擎的文件不删除，否则朗读对应句子时会找不到文件
+            if key in self._registered:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
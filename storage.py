@@ -0,0 +1,516 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+import weakref
+import zlib
+from concurrent.futures import Future
+
+# 单次提交最多合并的写操作数
+WRITE_BATCH = 64
+
+# busy_timeout 必须最先设置，后面几条在库被占用时也需要等待锁
+PRAGMAS = (
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA auto_vacuum = INCREMENTAL',
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -4000',
+)
+# 只读连接不修改库级设置，避免与写线程争锁
+READER_PRAGMAS = (
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA query_only = 1',
+)
+
+
+def _migrate_base(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date_str TEXT,
+            title TEXT,
+            summary TEXT,
+            full_json TEXT
+        )
+    ''')
+    # 二级缓存：图片内容哈希 -> 识别文字，规范化文字哈希 -> 结构化结果
+    for table in ('ocr_cache', 'result_cache'):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                size INTEGER,
+                created REAL,
+                last_used REAL
+            )
+        ''')
+
+
+def _migrate_timestamps(conn):
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(history)')]
+    if 'created_at' not in columns:
+        conn.execute('ALTER TABLE history ADD COLUMN created_at INTEGER')
+    # 旧记录只有本地时间字符串，按本地时间换算
+    conn.execute('''
+        UPDATE history SET created_at = CAST(strftime('%s', date_str, 'utc') AS INTEGER)
+        WHERE created_at IS NULL
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_date ON history (date_str)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_created ON history (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ocr_cache_used ON ocr_cache (last_used)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_result_cache_used ON result_cache (last_used)')
+
+
+def _migrate_fts(conn):
+    # trigram 分词对中文按字切分，无需词典；SQLite 未编译 FTS5 时跳过，搜索退化为 LIKE
+    try:
+        conn.execute('SAVEPOINT fts')
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_fts'").fetchone()
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+                title, core_conclusion, abnormal_analysis, life_advice,
+                tokenize = 'trigram'
+            )
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS history_fts_ai AFTER INSERT ON history BEGIN
+                INSERT INTO history_fts (rowid, title, core_conclusion, abnormal_analysis, life_advice)
+                VALUES (new.id, new.title, new.summary,
+                        json_extract(new.full_json, '$.abnormal_analysis'),
+                        json_extract(new.full_json, '$.life_advice'));
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS history_fts_ad AFTER DELETE ON history BEGIN
+                DELETE FROM history_fts WHERE rowid = old.id;
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS history_fts_au AFTER UPDATE ON history BEGIN
+                DELETE FROM history_fts WHERE rowid = old.id;
+                INSERT INTO history_fts (rowid, title, core_conclusion, abnormal_analysis, life_advice)
+                VALUES (new.id, new.title, new.summary,
+                        json_extract(new.full_json, '$.abnormal_analysis'),
+                        json_extract(new.full_json, '$.life_advice'));
+            END
+        ''')
+        if not exists:
+            conn.execute('''
+                INSERT INTO history_fts (rowid, title, core_conclusion, abnormal_analysis, life_advice)
+                SELECT id, title, summary,
+                       json_extract(full_json, '$.abnormal_analysis'),
+                       json_extract(full_json, '$.life_advice')
+                FROM history
+            ''')
+        conn.execute('RELEASE fts')
+    except sqlite3.Error as e:
+        print(f"FTS Unavailable: {e}")
+        conn.execute('ROLLBACK TO fts')
+        conn.execute('RELEASE fts')
+
+
+def encode_payload(data):
+    # history.full_json 以 zlib 压缩的 BLOB 存储，旧版本遗留的 TEXT 在读取时原样解析
+    return encode_text(json.dumps(data, ensure_ascii=False))
+
+
+def encode_text(text):
+    return zlib.compress(text.encode('utf-8'), 6)
+
+
+def decode_text(value):
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+
+def decode_payload(value):
+    text = decode_text(value)
+    return json.loads(text) if text is not None else None
+
+
+def content_key(created_at, text):
+    # 记录内容键：时间戳 + 解压后的 JSON 文本，用于导入历史时去重
+    return hashlib.sha256(f"{created_at}\0{text}".encode('utf-8')).hexdigest()
+
+
+FTS_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS history_fts_ai AFTER INSERT ON history BEGIN
+        INSERT INTO history_fts (rowid, title, core_conclusion, abnormal_analysis, life_advice)
+        VALUES (new.id, new.title, new.summary,
+                json_extract(decode_text(new.full_json), '$.abnormal_analysis'),
+                json_extract(decode_text(new.full_json), '$.life_advice'));
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS history_fts_ad AFTER DELETE ON history BEGIN
+        DELETE FROM history_fts WHERE rowid = old.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS history_fts_au AFTER UPDATE OF title, summary, full_json ON history BEGIN
+        DELETE FROM history_fts WHERE rowid = old.id;
+        INSERT INTO history_fts (rowid, title, core_conclusion, abnormal_analysis, life_advice)
+        VALUES (new.id, new.title, new.summary,
+                json_extract(decode_text(new.full_json), '$.abnormal_analysis'),
+                json_extract(decode_text(new.full_json), '$.life_advice'));
+    END
+    ''',
+)
+
+
+def _migrate_compress(conn):
+    # 先移除旧触发器，避免逐行压缩时重复重建全文索引
+    for name in ('history_fts_ai', 'history_fts_ad', 'history_fts_au'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, full_json FROM history WHERE id > ? AND typeof(full_json) = 'text' ORDER BY id LIMIT 200",
+            (last_id,)).fetchall()
+        if not rows:
+            break
+        conn.executemany('UPDATE history SET full_json = ? WHERE id = ?',
+                         [(zlib.compress(r[1].encode('utf-8'), 6), r[0]) for r in rows])
+        last_id = rows[-1][0]
+
+    has_fts = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_fts'").fetchone()
+    if has_fts:
+        for stmt in FTS_TRIGGERS:
+            conn.execute(stmt)
+
+
+def _migrate_lab_values(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lab_values (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            record_id INTEGER NOT NULL,
+            test_key TEXT NOT NULL,
+            test_name TEXT,
+            value REAL,
+            value_text TEXT,
+            unit TEXT,
+            ref_low REAL,
+            ref_high REAL,
+            ref_text TEXT,
+            flag TEXT,
+            created_at INTEGER
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_lab_test_time ON lab_values (test_key, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_lab_record ON lab_values (record_id)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS history_lab_ad AFTER DELETE ON history BEGIN
+            DELETE FROM lab_values WHERE record_id = old.id;
+        END
+    ''')
+    # 标记是否已提取检验项目，旧记录由后台任务回填
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(history)')]
+    if 'labs_indexed' not in columns:
+        conn.execute('ALTER TABLE history ADD COLUMN labs_indexed INTEGER NOT NULL DEFAULT 0')
+
+
+def _migrate_jobs(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            state TEXT NOT NULL,
+            image_paths TEXT NOT NULL,
+            ocr_text TEXT,
+            result_json TEXT,
+            record_id INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at REAL,
+            updated_at REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, next_attempt_at)')
+
+
+def _migrate_metrics(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stage TEXT NOT NULL,
+            provider TEXT,
+            ms REAL NOT NULL,
+            bytes INTEGER,
+            outcome TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_metrics_stage ON metrics (stage, created_at)')
+
+
+def _migrate_archive(conn):
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(history)')]
+    if 'content_key' not in columns:
+        conn.execute('ALTER TABLE history ADD COLUMN content_key TEXT')
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, created_at, full_json FROM history WHERE id > ? AND content_key IS NULL ORDER BY id LIMIT 200
+        ''', (last_id,)).fetchall()
+        if not rows:
+            break
+        conn.executemany('UPDATE history SET content_key = ? WHERE id = ?',
+                         [(content_key(r[1], decode_text(r[2])), r[0]) for r in rows])
+        last_id = rows[-1][0]
+    # 同一秒内保存两份相同结果是允许的，因此不加唯一约束，去重只在导入时进行
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_content ON history (content_key)')
+
+    # 导入的历史归档可附带报告图片的缩略图
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS history_thumbs (
+            record_id INTEGER NOT NULL,
+            idx INTEGER NOT NULL,
+            jpeg BLOB NOT NULL,
+            PRIMARY KEY (record_id, idx)
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS history_thumbs_ad AFTER DELETE ON history BEGIN
+            DELETE FROM history_thumbs WHERE record_id = old.id;
+        END
+    ''')
+
+
+# 版本号写入 PRAGMA user_version，只追加不修改
+MIGRATIONS = [
+    (1, _migrate_base),
+    (2, _migrate_timestamps),
+    (3, _migrate_fts),
+    (4, _migrate_compress),
+    (5, _migrate_lab_values),
+    (6, _migrate_jobs),
+    (7, _migrate_metrics),
+    (8, _migrate_archive),
+]
+
+
+# 写队列中表示检查点的标记
+_CHECKPOINT = object()
+
+
+class _Reader:
+    # 每线程只读连接的持有者，可被弱引用，用于在线程退出时关闭连接
+    __slots__ = ('conn', '__weakref__')
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class Database:
+    """单写线程 + 每线程只读连接的 SQLite 封装。
+
+    写操作进入队列，由写线程合并到同一事务批量提交；读操作使用当前线程自己的连接，
+    在 WAL 模式下不会被写入阻塞。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._readers = set()
+        self._readers_lock = threading.Lock()
+        self._queue = queue.Queue()
+
+        self._writer = self._connect()
+        self.migrate()
+        self.fts_enabled = self._writer.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_fts'").fetchone() is not None
+
+        self._thread = threading.Thread(target=self._write_loop, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def _connect(self, pragmas=PRAGMAS):
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.create_function('decode_text', 1, decode_text, deterministic=True)
+        for pragma in pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def migrate(self):
+        conn = self._writer
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for target, step in MIGRATIONS:
+            if target <= version:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                step(conn)
+                conn.execute(f'PRAGMA user_version = {target}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            print(f"[DB] migrated to v{target}")
+
+        # 旧库创建时未开启增量回收，需要一次完整 VACUUM 才能切换
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+
+    # --- Reads ---
+    def _reader(self):
+        reader = getattr(self._local, 'reader', None)
+        if reader is None:
+            reader = _Reader(self._connect(READER_PRAGMAS))
+            with self._readers_lock:
+                self._readers.add(reader.conn)
+            # 线程退出时其 threading.local 数据被释放，连接随之关闭；短生命周期的线程不会积累连接
+            weakref.finalize(reader, self._close_reader, reader.conn)
+            self._local.reader = reader
+        return reader.conn
+
+    def _close_reader(self, conn):
+        with self._readers_lock:
+            self._readers.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def query(self, sql, params=()):
+        return self._reader().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        return self._reader().execute(sql, params).fetchone()
+
+    def iterate(self, sql, params=()):
+        # 逐行读取大结果集，不一次性载入内存
+        cursor = self._reader().execute(sql, params)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    # --- Writes ---
+    def submit(self, fn):
+        # fn(conn) 在写线程中执行，返回值通过 Future 取回
+        fut = Future()
+        self._queue.put((fn, fut))
+        return fut
+
+    def execute(self, sql, params=()):
+        return self.submit(lambda conn: conn.execute(sql, params).lastrowid)
+
+    def executemany(self, sql, seq):
+        return self.submit(lambda conn: conn.executemany(sql, seq).rowcount)
+
+    def checkpoint(self):
+        # 把 WAL 中的内容写回主库并截断 WAL 文件；在写线程中、事务之外执行，不与写操作争锁
+        fut = Future()
+        self._queue.put((_CHECKPOINT, fut))
+        return fut
+
+    def _write_loop(self):
+        conn = self._writer
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch, held = [item], None
+            if item[0] is _CHECKPOINT:
+                batch, held = [], item
+            while batch and len(batch) < WRITE_BATCH:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.put(None)
+                    break
+                if nxt[0] is _CHECKPOINT:
+                    # 先提交已取出的写操作，再执行检查点
+                    held = nxt
+                    break
+                batch.append(nxt)
+            if batch:
+                self._run_batch(conn, batch)
+            if held:
+                self._run_checkpoint(conn, held[1])
+        conn.close()
+
+    @staticmethod
+    def _run_checkpoint(conn, fut):
+        try:
+            fut.set_result(conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone())
+        except Exception as e:
+            fut.set_exception(e)
+
+    def _run_batch(self, conn, batch):
+        results = []
+        try:
+            conn.execute('BEGIN')
+            for fn, fut in batch:
+                # 每个写操作一个保存点，单条失败不影响同批其他写入
+                conn.execute('SAVEPOINT op')
+                try:
+                    results.append((fut, fn(conn), None))
+                    conn.execute('RELEASE op')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO op')
+                    conn.execute('RELEASE op')
+                    results.append((fut, None, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            print(f"DB Commit Error: {e}")
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        for fut, value, error in results:
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(value)
+
+    def compact(self, pages=256):
+        # 每次只回收少量空闲页，期间其他写操作可以穿插执行
+        total = 0
+        while True:
+            freed = self.submit(lambda conn: self._vacuum_step(conn, pages)).result()
+            if not freed:
+                break
+            total += freed
+
+        self.checkpoint().result()
+        return total
+
+    @staticmethod
+    def _vacuum_step(conn, pages):
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if not before:
+            return 0
+        conn.execute(f'PRAGMA incremental_vacuum({pages})').fetchall()
+        return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+    def flush(self, timeout=None):
+        # 等待此前提交的写操作全部落盘
+        return self.submit(lambda conn: None).result(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        with self._readers_lock:
+            readers, self._readers = self._readers, set()
+        for conn in readers:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass